@@ -0,0 +1,79 @@
+"""Compare the json and compact1 websocket protocols.
+
+Usage: python benchmarks/bench_protocol.py
+
+Reports encode/decode time and bytes per message for a typical status
+delta and a full snapshot, raw and after permessage-deflate (emulated with
+a zlib stream kept across messages, as websockets does by default).
+"""
+import os
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ipx800_v1_addon"))
+
+import protocol  # noqa: E402
+
+SNAPSHOT = {
+    "action": "status_update",
+    "ip_address": "192.168.1.50",
+    "seq": 1234,
+    "status": {
+        "led0": "1", "led1": "0", "led2": "0", "led3": "1",
+        "led4": "0", "led5": "0", "led6": "0", "led7": "0",
+        "btn0": "up", "btn1": "up", "btn2": "dn", "btn3": "up",
+        "an0": "512", "an1": "0",
+        "count0": "1024", "count1": "3", "count2": "0",
+    },
+}
+DELTA = {
+    "action": "status_delta",
+    "ip_address": "192.168.1.50",
+    "seq": 1235,
+    "changes": {"led3": "0", "btn2": "up", "count0": "1025"},
+}
+
+
+def deflated_size(payloads):
+    """Average compressed bytes per message with a shared deflate context."""
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    total = 0
+    for payload in payloads:
+        data = payload.encode()
+        # permessage-deflate retire les 4 derniers octets du flush
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total / len(payloads)
+
+
+def message_stream(message, count=200):
+    """Successive messages with moving seq and counter values."""
+    stream = []
+    for index in range(count):
+        msg = dict(message, seq=message["seq"] + index)
+        key = "changes" if "changes" in msg else "status"
+        msg[key] = dict(msg[key], count0=str(1024 + index), an0=str(500 + index % 37))
+        stream.append(msg)
+    return stream
+
+
+def bench(name, message, number=50000):
+    print(f"{name}")
+    for proto in (protocol.JSON, protocol.COMPACT_V1):
+        encoded = protocol.encode_status(message, proto)
+        encode = timeit.timeit(lambda: protocol.encode_status(message, proto), number=number)
+        decode = timeit.timeit(lambda: protocol.decode_message(encoded), number=number)
+        stream = [protocol.encode_status(msg, proto) for msg in message_stream(message)]
+        print(
+            f"  {proto:9s}: encode {encode / number * 1e6:6.2f} us, decode {decode / number * 1e6:6.2f} us, "
+            f"{len(encoded):4d} bytes raw, {deflated_size(stream):6.1f} bytes deflated"
+        )
+
+
+def main():
+    bench("status_delta (3 changed tags)", DELTA)
+    bench("status_update (full snapshot)", SNAPSHOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Compare status_parser.parse_status with the former ElementTree path.
+
+Usage: python benchmarks/bench_status_parser.py [status.xml ...]
+
+Without arguments the bundled IPX800 V1 payloads are used; pass files
+captured with `curl http://<ip>/status.xml` to benchmark real responses.
+"""
+import os
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ipx800_v1_addon"))
+
+from status_parser import parse_status  # noqa: E402
+from status_delta import StatusTracker  # noqa: E402
+
+FULL_STATUS = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<response>
+<led0>1</led0>
+<led1>0</led1>
+<led2>0</led2>
+<led3>1</led3>
+<led4>0</led4>
+<led5>0</led5>
+<led6>0</led6>
+<led7>0</led7>
+<btn0>up</btn0>
+<btn1>up</btn1>
+<btn2>dn</btn2>
+<btn3>up</btn3>
+<an0>512</an0>
+<an1>0</an1>
+<count0>1024</count0>
+<count1>3</count1>
+<count2>0</count2>
+</response>
+"""
+TRUNCATED_STATUS = FULL_STATUS[:FULL_STATUS.index("<an0>") + 7]
+
+
+def elementtree_path(xml_data, previous_status):
+    root = ET.fromstring(xml_data)
+    status = {child.tag: child.text for child in root}
+    changes = {tag: value for tag, value in status.items() if previous_status.get(tag) != value}
+    previous_status.update(status)
+    return changes
+
+
+def parser_path(xml_data, tracker):
+    return tracker.update_record(parse_status(xml_data))
+
+
+def bench(name, xml_data, number=20000):
+    previous_status = {}
+    tracker = StatusTracker("bench")
+    print(f"{name} ({len(xml_data)} bytes, {number} iterations)")
+    try:
+        elapsed = timeit.timeit(lambda: elementtree_path(xml_data, previous_status), number=number)
+        print(f"  ElementTree   : {elapsed / number * 1e6:8.2f} us/status")
+    except ET.ParseError as e:
+        print(f"  ElementTree   : fails ({e})")
+    elapsed = timeit.timeit(lambda: parser_path(xml_data, tracker), number=number)
+    print(f"  parse_status  : {elapsed / number * 1e6:8.2f} us/status")
+    print(f"  parsed tags   : {len(parse_status(xml_data).as_dict())}")
+
+
+def main():
+    payloads = [("full status.xml", FULL_STATUS), ("truncated status.xml", TRUNCATED_STATUS)]
+    for path in sys.argv[1:]:
+        with open(path, encoding="latin-1") as f:
+            payloads.append((path, f.read()))
+    for name, xml_data in payloads:
+        bench(name, xml_data)
+
+
+if __name__ == "__main__":
+    main()
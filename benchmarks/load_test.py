@@ -0,0 +1,320 @@
+"""Load test of the addon websocket server against simulated boards.
+
+Usage: python benchmarks/load_test.py --spawn [--boards N] [--clients M] [--duration S] [options]
+
+Starts N simulated IPX800 V1 boards (see simulator.py) and M websocket
+clients that all follow every board. With --spawn the addon itself is
+started with a temporary database directory and options file; otherwise
+it must already run on --ws-url (with IPX800_DB_DIR set when outside
+Home Assistant).
+
+Every board gets one device bound to btn0 -> led0. Buttons are pressed
+randomly, an0 drifts and each client sends set_led_state commands. The
+report gives percentiles for:
+- poll RTT: status.xml round trip seen by the addon, from its
+  ipx800_poll_seconds histogram (bucket upper bounds; needs the metrics
+  port, set for a spawned addon);
+- change -> client: an0 change on the board to status_delta at a client;
+- button -> relay: btn0 edge to the preset.htm toggling led0, only for
+  polls that saw an odd number of edges (an even number toggles nothing);
+- command RTT: set_led_state request to its reply;
+and request, message and command throughput.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import websockets
+
+import simulator
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ipx800_v1_addon"))
+
+import protocol  # noqa: E402
+
+ADDON = os.path.join(os.path.dirname(__file__), "..", "ipx800_v1_addon", "ipx800_v1.py")
+
+
+class Measurements:
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+        self.counts = collections.Counter()
+        self.analog_changes = {}
+        self.pending_edges = collections.defaultdict(list)
+        self.polls = collections.Counter()
+        # Écritures attendues par carte : (numéro du poll, instant du premier front)
+        self.awaiting_writes = collections.defaultdict(list)
+
+    def reset(self):
+        self.samples.clear()
+        self.counts.clear()
+        self.pending_edges.clear()
+        self.awaiting_writes.clear()
+
+    def on_poll(self, board, at):
+        self.counts["status.xml"] += 1
+        self.polls[board.address] += 1
+        poll = self.polls[board.address]
+        edges = self.pending_edges.pop(board.address, [])
+        # Une écriture arrive pendant le traitement de son poll : au-delà, elle ne viendra plus
+        awaiting = [item for item in self.awaiting_writes[board.address] if item[0] >= poll - 2]
+        # Un nombre pair de fronts entre deux polls ne bascule pas la LED
+        if len(edges) % 2:
+            awaiting.append((poll, edges[0]))
+        self.awaiting_writes[board.address] = awaiting
+
+    def on_press(self, board, button, at):
+        if button == 0:
+            self.pending_edges[board.address].append(at)
+            self.counts["btn0 edges"] += 1
+
+    def on_preset(self, board, leds, at):
+        self.counts["preset.htm"] += 1
+        awaiting = self.awaiting_writes[board.address]
+        if 0 in leds and awaiting:
+            _, edge_at = awaiting.pop(0)
+            self.samples["button -> relay"].append(at - edge_at)
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+    return {"n": len(values), "p50": pick(50), "p90": pick(90), "p99": pick(99), "max": values[-1]}
+
+
+async def fetch_poll_buckets(url):
+    """Cumulative ipx800_poll_seconds buckets summed over boards: {upper bound: count}."""
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                text = await response.text()
+    except aiohttp.ClientError:
+        return None
+    buckets = collections.Counter()
+    for line in text.splitlines():
+        if line.startswith("ipx800_poll_seconds_bucket{"):
+            labels, value = line.rsplit(" ", 1)
+            buckets[float(labels.split('le="')[1].split('"')[0])] += float(value)
+    return buckets
+
+
+def bucket_percentiles(before, after):
+    """Percentiles as bucket upper bounds, for the polls between two scrapes."""
+    if not before or not after:
+        return None
+    cumulative = sorted((bound, after[bound] - before.get(bound, 0)) for bound in after)
+    total = cumulative[-1][1] if cumulative else 0
+    if not total:
+        return None
+
+    def pick(p):
+        return next(bound for bound, count in cumulative if count >= p / 100 * total)
+    return {"n": int(total), "p50": pick(50), "p90": pick(90), "p99": pick(99), "max": pick(100)}
+
+
+class BenchClient:
+    """Websocket client following every board, with id-correlated requests."""
+
+    def __init__(self, url, measurements):
+        self.url = url
+        self.measurements = measurements
+        self.websocket = None
+        self._pending = {}
+        self._next_id = 0
+        self._reader = None
+
+    async def connect(self, attempts=50):
+        for attempt in range(attempts):
+            try:
+                self.websocket = await websockets.connect(self.url, max_size=None)
+                break
+            except OSError:
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(0.2)
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def request(self, action, timeout=10, **payload):
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self.websocket.send(json.dumps({"action": action, "id": request_id, **payload}))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _read(self):
+        measurements = self.measurements
+        async for message in self.websocket:
+            received = time.monotonic()
+            measurements.counts["client messages"] += 1
+            measurements.counts["client bytes"] += len(message)
+            data = protocol.decode_message(message)
+            future = self._pending.get(data.get("id"))
+            if future is not None and not future.done():
+                future.set_result(data)
+            elif data.get("action") == "status_delta" and "an0" in data["changes"]:
+                changed = measurements.analog_changes.get((data["ip_address"], data["changes"]["an0"]))
+                if changed is not None:
+                    measurements.samples["change -> client"].append(received - changed)
+
+    async def send_commands(self, boards, rate):
+        """set_led_state on led1 of a random board, rate commands per second."""
+        state = False
+        while True:
+            await asyncio.sleep(1 / rate)
+            board = boards[self.measurements.counts["commands"] % len(boards)]
+            state = not state
+            sent = time.monotonic()
+            self.measurements.counts["commands"] += 1
+            try:
+                reply = await self.request(
+                    "set_led_state", ip_address=board.address, leds=["led1"], state=state,
+                    variable_etat_name="bench"
+                )
+            except asyncio.TimeoutError:
+                self.measurements.counts["command timeouts"] += 1
+                continue
+            if reply.get("action") == "error" or not reply.get("ok"):
+                self.measurements.counts["command errors"] += 1
+            self.measurements.samples["command RTT"].append(time.monotonic() - sent)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self.websocket is not None:
+            await self.websocket.close()
+
+
+async def drift_analogs(boards, interval, measurements):
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        for board in boards:
+            board.analogs[0] = (board.analogs[0] + 1) % 1024
+            measurements.analog_changes[(board.address, str(board.analogs[0]))] = now
+
+
+def spawn_addon(args, db_dir):
+    options_path = os.path.join(db_dir, "options.json")
+    with open(options_path, "w") as f:
+        json.dump({
+            "button_counters": "btn0:count0",
+            "history_enabled": not args.no_history,
+            "workers": args.workers,
+            "metrics_port": args.metrics_port,
+        }, f)
+    env = dict(os.environ, IPX800_DB_DIR=db_dir, IPX800_OPTIONS=options_path, IPX800_WS_PORT=str(args.ws_port))
+    log = open(os.path.join(db_dir, "addon.log"), "w")
+    return subprocess.Popen([sys.executable, ADDON], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def print_report(measurements, elapsed, poll_stats):
+    print(f"\n{'latency (ms)':<18}{'n':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name in ("poll RTT (<=)", "change -> client", "button -> relay", "command RTT"):
+        stats = poll_stats if name == "poll RTT (<=)" else percentiles(measurements.samples[name])
+        if stats is None:
+            print(f"{name:<18}{0:>8}")
+            continue
+        print(f"{name:<18}{stats['n']:>8}" + "".join(
+            f"{stats[key] * 1000:>10.1f}" for key in ("p50", "p90", "p99", "max")
+        ))
+    print(f"\n{'throughput':<18}{'total':>10}{'per s':>10}")
+    for name, count in sorted(measurements.counts.items()):
+        print(f"{name:<18}{count:>10}{count / elapsed:>10.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    simulator.add_arguments(parser)
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--analog-interval", type=float, default=0.5)
+    parser.add_argument("--command-rate", type=float, default=1.0, help="set_led_state per second per client")
+    parser.add_argument("--ws-url", default=None)
+    parser.add_argument("--ws-port", type=int, default=16789)
+    parser.add_argument("--spawn", action="store_true", help="start the addon with a temporary database")
+    parser.add_argument("--no-history", action="store_true", help="disable the history store of a spawned addon")
+    parser.add_argument("--workers", type=int, default=0, help="board worker processes of a spawned addon")
+    parser.add_argument("--metrics-port", type=int, default=16788, help="metrics port of a spawned addon")
+    parser.add_argument("--metrics-url", default=None, help="metrics of an addon already running")
+    args = parser.parse_args()
+    if args.press_interval <= 0:
+        args.press_interval = 2.0
+
+    measurements = Measurements()
+    boards = await simulator.start_boards(args.boards, args.base_port, **simulator.board_options(args))
+    for board in boards:
+        board.on_poll = measurements.on_poll
+        board.on_press = measurements.on_press
+        board.on_preset = measurements.on_preset
+
+    db_dir = tempfile.mkdtemp(prefix="ipx800_bench_")
+    addon = spawn_addon(args, db_dir) if args.spawn else None
+    url = args.ws_url or f"ws://127.0.0.1:{args.ws_port}"
+    clients = [BenchClient(url, measurements) for _ in range(args.clients)]
+    metrics_url = args.metrics_url or (f"http://127.0.0.1:{args.metrics_port}/metrics" if args.spawn else None)
+    tasks = []
+    elapsed = 0.0
+    poll_stats = None
+    try:
+        for client in clients:
+            await client.connect()
+        for index, board in enumerate(boards):
+            await clients[0].request(
+                "add_device", ip_address=board.address, device_name=f"bench {index}", input_button="btn0",
+                select_leds=["led0"], unique_id=f"bench_{index}", variable_etat_name=f"etat_bench_{index}"
+            )
+        for client in clients:
+            await client.request("hello", protocols=list(protocol.PROTOCOLS))
+            for index, board in enumerate(boards):
+                await client.request(
+                    "init_device", ip_address=board.address, device_name=f"bench board {index}",
+                    poll_interval=args.poll_interval, unique_id=f"bench_board_{index}"
+                )
+        print(f"{args.boards} board(s), {args.clients} client(s), running for {args.duration}s")
+
+        loop = asyncio.get_running_loop()
+        measurements.reset()
+        poll_before = await fetch_poll_buckets(metrics_url) if metrics_url else None
+        for board in boards:
+            tasks.append(loop.create_task(simulator.random_presses(board, args.press_interval, args.press_hold, 1)))
+        tasks.append(loop.create_task(drift_analogs(boards, args.analog_interval, measurements)))
+        if args.command_rate > 0:
+            tasks += [loop.create_task(client.send_commands(boards, args.command_rate)) for client in clients]
+        started = time.monotonic()
+        await asyncio.sleep(args.duration)
+        elapsed = time.monotonic() - started
+        if metrics_url:
+            poll_stats = bucket_percentiles(poll_before, await fetch_poll_buckets(metrics_url))
+    finally:
+        for task in tasks:
+            task.cancel()
+        for client in clients:
+            await client.close()
+        if addon is not None:
+            addon.terminate()
+            addon.wait()
+        for board in boards:
+            await board.stop()
+    print_report(measurements, elapsed, poll_stats)
+    if addon is not None:
+        print(f"\nAddon log and databases: {db_dir}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
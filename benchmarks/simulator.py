@@ -0,0 +1,238 @@
+"""Simulated IPX800 V1 boards for local tests and benchmarks.
+
+Usage: python benchmarks/simulator.py [--boards N] [--base-port PORT] [options]
+
+Each board is an HTTP server on 127.0.0.1:<port> serving status.xml and
+accepting preset.htm, so the addon can poll it as "127.0.0.1:<port>".
+Latency, jitter and a failure rate can be injected, and buttons can be
+pressed randomly (--press-interval) or from a script (--script).
+
+A script is a comma separated list of time:button:hold, e.g.
+"1.0:btn0:0.05,2.5:btn1:0.3" presses btn0 one second after start for
+50 ms, then btn1 for 300 ms. With --script-repeat it loops forever.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LED_COUNT = 8
+BUTTON_COUNT = 4
+ANALOG_COUNT = 2
+COUNTER_COUNT = 3
+RELEASED = "up"
+PRESSED = "dn"
+
+
+class SimulatedBoard:
+    """State and HTTP handlers of one simulated IPX800 V1.
+
+    on_poll(board, time), on_press(board, button, time) and
+    on_preset(board, leds, time) are called for every status.xml served,
+    every button edge and every accepted preset.htm, so a load driver can
+    measure end-to-end latencies.
+    """
+
+    def __init__(self, port, latency=0.0, jitter=0.0, failure_rate=0.0, single_led=False):
+        self.port = port
+        self.address = f"127.0.0.1:{port}"
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        # Ancien firmware : une seule LED par preset.htm
+        self.single_led = single_led
+        self.leds = [0] * LED_COUNT
+        self.buttons = [RELEASED] * BUTTON_COUNT
+        self.analogs = [0] * ANALOG_COUNT
+        self.counters = [0] * COUNTER_COUNT
+        self.on_poll = None
+        self.on_press = None
+        self.on_preset = None
+        self.requests = 0
+        self.failures = 0
+        self._runner = None
+
+    def status_xml(self):
+        parts = ["<response>"]
+        parts += [f"<led{i}>{value}</led{i}>" for i, value in enumerate(self.leds)]
+        parts += [f"<btn{i}>{value}</btn{i}>" for i, value in enumerate(self.buttons)]
+        parts += [f"<an{i}>{value}</an{i}>" for i, value in enumerate(self.analogs)]
+        parts += [f"<count{i}>{value}</count{i}>" for i, value in enumerate(self.counters)]
+        parts.append("</response>")
+        return "".join(parts)
+
+    async def _delay(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _fails(self):
+        return self.failure_rate and random.random() < self.failure_rate
+
+    async def handle_status(self, request):
+        self.requests += 1
+        await self._delay()
+        if self._fails():
+            self.failures += 1
+            return web.Response(status=500)
+        if self.on_poll is not None:
+            self.on_poll(self, time.monotonic())
+        return web.Response(text=self.status_xml(), content_type="text/xml")
+
+    async def handle_preset(self, request):
+        self.requests += 1
+        await self._delay()
+        if self._fails():
+            self.failures += 1
+            return web.Response(status=500)
+        leds = {}
+        for key, value in request.query.items():
+            if key.startswith("led") and key[3:].isdigit() and int(key[3:]) < LED_COUNT and value in ("0", "1"):
+                leds[int(key[3:])] = int(value)
+        if not leds or (self.single_led and len(leds) > 1):
+            return web.Response(status=400)
+        for index, value in leds.items():
+            self.leds[index] = value
+        if self.on_preset is not None:
+            self.on_preset(self, leds, time.monotonic())
+        return web.Response(text="OK")
+
+    async def press(self, button, hold):
+        """Press a button for hold seconds; btnN drives countN when it exists."""
+        self._set_button(button, PRESSED)
+        if button < COUNTER_COUNT:
+            self.counters[button] += 1
+        await asyncio.sleep(hold)
+        self._set_button(button, RELEASED)
+
+    def _set_button(self, button, value):
+        self.buttons[button] = value
+        if self.on_press is not None:
+            self.on_press(self, button, time.monotonic())
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/status.xml", self.handle_status)
+        app.router.add_get("/preset.htm", self.handle_preset)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def parse_script(text):
+    """'1.0:btn0:0.05,2.5:btn1:0.3' -> [(1.0, 0, 0.05), (2.5, 1, 0.3)]"""
+    steps = []
+    for item in (text or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        at, button, hold = item.split(":")
+        if not button.startswith("btn") or not 0 <= int(button[3:]) < BUTTON_COUNT:
+            raise ValueError(f"Invalid button in script: {item}")
+        steps.append((float(at), int(button[3:]), float(hold)))
+    return sorted(steps)
+
+
+async def run_script(board, steps, repeat=False):
+    while True:
+        start = time.monotonic()
+        for at, button, hold in steps:
+            await asyncio.sleep(max(0.0, start + at - time.monotonic()))
+            asyncio.get_running_loop().create_task(board.press(button, hold))
+        if not repeat or not steps:
+            return
+        await asyncio.sleep(max(0.0, start + steps[-1][0] + steps[-1][2] - time.monotonic()))
+
+
+async def random_presses(board, interval, hold, buttons=BUTTON_COUNT):
+    """Press a random button every interval seconds on average."""
+    while True:
+        await asyncio.sleep(random.expovariate(1 / interval))
+        asyncio.get_running_loop().create_task(board.press(random.randrange(buttons), hold))
+
+
+async def drift_analogs(board, interval):
+    """Change an0 every interval seconds, so pollers always have something to report."""
+    while True:
+        await asyncio.sleep(interval)
+        board.analogs[0] = (board.analogs[0] + 1) % 1024
+
+
+async def start_boards(count, base_port, **options):
+    boards = [SimulatedBoard(base_port + index, **options) for index in range(count)]
+    for board in boards:
+        await board.start()
+    return boards
+
+
+def add_arguments(parser):
+    parser.add_argument("--boards", type=int, default=1)
+    parser.add_argument("--base-port", type=int, default=18000)
+    parser.add_argument("--latency", type=float, default=0.005, help="response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.002, help="+/- random delay in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--single-led", action="store_true", help="refuse several LEDs in one preset.htm")
+    parser.add_argument("--press-interval", type=float, default=0.0, help="mean seconds between random presses")
+    parser.add_argument("--press-hold", type=float, default=0.1, help="seconds a button stays pressed")
+    parser.add_argument("--script", default="", help="time:button:hold,... presses")
+    parser.add_argument("--script-repeat", action="store_true")
+
+
+def board_options(args):
+    return {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "failure_rate": args.failure_rate,
+        "single_led": args.single_led,
+    }
+
+
+def start_activity(boards, args, analog_interval=None):
+    loop = asyncio.get_running_loop()
+    steps = parse_script(args.script)
+    tasks = []
+    for board in boards:
+        if steps:
+            tasks.append(loop.create_task(run_script(board, steps, args.script_repeat)))
+        if args.press_interval > 0:
+            tasks.append(loop.create_task(random_presses(board, args.press_interval, args.press_hold)))
+        if analog_interval:
+            tasks.append(loop.create_task(drift_analogs(board, analog_interval)))
+    return tasks
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--analog-interval", type=float, default=0.0, help="seconds between an0 changes")
+    args = parser.parse_args()
+
+    boards = await start_boards(args.boards, args.base_port, **board_options(args))
+    start_activity(boards, args, args.analog_interval)
+    for board in boards:
+        board.on_press = lambda board, button, at: logger.info(f"{board.address} btn{button} {board.buttons[button]}")
+        board.on_preset = lambda board, leds, at: logger.info(f"{board.address} preset {leds}")
+        logger.info(f"Simulated IPX800 V1 on http://{board.address}/status.xml")
+    try:
+        await asyncio.Future()
+    finally:
+        for board in boards:
+            await board.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
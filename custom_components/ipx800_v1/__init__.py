@@ -1,19 +1,32 @@
 import logging
 import asyncio
+import itertools
+import time
 import websockets
 import json
 import sqlite3
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 from homeassistant.helpers import device_registry as dr, entity_registry as er
+from homeassistant.helpers.event import async_call_later
 from homeassistant.components.http import HomeAssistantView
 from datetime import timedelta, datetime
+from functools import partial
 
-from .const import DOMAIN, IP_ADDRESS, POLL_INTERVAL, WEBSOCKET_URL, WS_PORT
+from .const import (
+    DOMAIN, PLATFORMS, IP_ADDRESS, POLL_INTERVAL, PUSH_MODE, WEBSOCKET_URL, WS_PORT, RPC_TIMEOUT, OPTIMISTIC_TIMEOUT,
+    DB_PATH, DEVICES_DATA, DEVICES_TTL,
+)
+from .protocol import PROTOCOLS, decode_message
 
 _LOGGER = logging.getLogger(__name__)
 
+def mask_to_leds(mask):
+    # Bit i du masque de l'addon (devices.led_mask) : "led<i>"
+    return [f"led{index}" for index in range(8) if mask >> index & 1]
+
 def clean_entity_name(name):
     return name.lower().replace(' ', '_').replace('é', 'e').replace('è', 'e').replace('ê', 'e').replace('à', 'a').replace('ç', 'c')
 
@@ -29,163 +42,428 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     if entry.entry_id in hass.data[DOMAIN]:
         return False
 
+    setup_start = time.monotonic()
     poll_interval = int(entry.data.get("poll_interval", POLL_INTERVAL))
     websocket_url = entry.data.get("websocket_url", WEBSOCKET_URL)
+    # Entrées créées avant le mode push : garder le polling qu'elles avaient
+    push_mode = entry.data.get("push_mode", False)
 
-    coordinator = IPX800V1Coordinator(hass, entry, update_interval=poll_interval, websocket_url=websocket_url)
+    coordinator = IPX800V1Coordinator(
+        hass, entry, update_interval=poll_interval, websocket_url=websocket_url, push_mode=push_mode
+    )
 
     await coordinator.async_config_entry_first_refresh()
-    hass.data[DOMAIN][entry.entry_id] = coordinator
 
     devices = await coordinator.load_devices()
+    if devices is None:
+        # Base pas encore créée ou migrée par l'addon : réessayer plus tard
+        # plutôt que de supprimer les entités de tous les appareils
+        raise ConfigEntryNotReady(f"IPX800 addon database {DB_PATH} not ready")
+    hass.data[DOMAIN][entry.entry_id] = coordinator
     data = {**entry.data, "devices": devices}
     hass.config_entries.async_update_entry(entry, data=data)
 
-    await remove_existing_entities(hass, entry)
-    await setup_devices_and_entities(hass, entry, devices)
+    removed = reconcile_entities(hass, entry, devices)
+    # Chaque plateforme est chargée une seule fois et crée toutes ses entités
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     # Start the WebSocket connection
-    asyncio.create_task(coordinator.ensure_websocket_connection())
+    coordinator.websocket_task = hass.async_create_task(coordinator.ensure_websocket_connection())
 
-    _LOGGER.debug(f"Setup entry for {entry.entry_id} completed")
+    coordinator.setup_duration = time.monotonic() - setup_start
+    _LOGGER.info(
+        f"Setup entry for {entry.entry_id} completed in {coordinator.setup_duration * 1000:.0f} ms "
+        f"({len(devices)} devices, {removed} stale entities removed)"
+    )
     return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     if entry.entry_id in hass.data[DOMAIN]:
-        await hass.config_entries.async_forward_entry_unload(entry, "sensor")
-        await hass.config_entries.async_forward_entry_unload(entry, "light")
-        hass.data[DOMAIN].pop(entry.entry_id)
+        await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
+        coordinator = hass.data[DOMAIN].pop(entry.entry_id)
+        if coordinator.websocket_task is not None:
+            coordinator.websocket_task.cancel()
+        if coordinator.messages_task is not None:
+            coordinator.messages_task.cancel()
     return True
 
-async def setup_devices_and_entities(hass, entry, devices):
+def reconcile_entities(hass, entry, devices):
+    """Align the registries with the devices stored in the DB.
+
+    Registry entries of devices still in the DB are kept as they are (the
+    platforms reuse them); only entities of removed devices are deleted.
+    Nothing is pruned when the DB could not be read (devices is None).
+    Returns the number of entities removed.
+    """
+    if devices is None:
+        return 0
     device_registry = dr.async_get(hass)
     entity_registry = er.async_get(hass)
 
+    expected = set()
     for device in devices:
         device_name = device["device_name"]
-        unique_id = device["unique_id"]
-        device_id = device_registry.async_get_or_create(
+        device_registry.async_get_or_create(
             config_entry_id=entry.entry_id,
-            identifiers={(DOMAIN, unique_id)},
+            identifiers={(DOMAIN, device["unique_id"])},
             name=device_name,
             manufacturer="GCE Electronics",
             model="IPX800_V1",
             via_device=(DOMAIN, entry.entry_id)
-        ).id
-
-        light_entity_id = f"light.{clean_entity_name(device_name)}"
-        sensor_entity_id = f"sensor.{clean_entity_name(device_name)}"
-
-        if not entity_registry.async_is_registered(light_entity_id):
-            await hass.config_entries.async_forward_entry_setups(entry, ["light"])
-
-        if not entity_registry.async_is_registered(sensor_entity_id):
-            await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
+        )
+        expected.add(f"{entry.entry_id}_{clean_entity_name(device_name)}_light")
+        expected.add(f"{entry.entry_id}_{clean_entity_name(device_name)}_light_sensor")
 
-async def remove_existing_entities(hass, entry):
-    entity_registry = er.async_get(hass)
-    entities_to_remove = [
-        entity_id for entity_id in entity_registry.entities
-        if entity_registry.async_get(entity_id).config_entry_id == entry.entry_id
+    stale = [
+        entity.entity_id for entity in er.async_entries_for_config_entry(entity_registry, entry.entry_id)
+        if entity.unique_id not in expected
     ]
-    for entity_id in entities_to_remove:
+    for entity_id in stale:
         entity_registry.async_remove(entity_id)
+    return len(stale)
 
 class IPX800V1Coordinator(DataUpdateCoordinator):
-    def __init__(self, hass, config_entry, update_interval, websocket_url):
+    def __init__(self, hass, config_entry, update_interval, websocket_url, push_mode=PUSH_MODE):
+        # En mode push, pas de get_data périodique : l'addon pousse les changements
         super().__init__(
             hass,
             _LOGGER,
             name="IPX800",
-            update_interval=timedelta(seconds=update_interval),
+            update_interval=None if push_mode else timedelta(seconds=update_interval),
         )
+        self.push_mode = push_mode
         self.config_entry = config_entry
         self._last_update = None
         self.websocket_url = websocket_url
         self.websocket = None
+        self.websocket_task = None
+        self.messages_task = None
+        self.setup_duration = None
         self.message_queue = asyncio.Queue()  # Initialisation de message_queue
+        # État des appareils en mémoire, indexé par device_name
+        self.device_states = {}
+        self._device_leds = {}
+        self._entity_devices = {}
+        self._rebuild_task = None
+        # Dernier status.xml connu de la carte, tenu à jour par les deltas
+        self.status = {}
+        self.status_seq = None
+        self.protocol = None
+        # Requêtes en attente de leur réponse, indexées par id
+        self._pending = {}
+        self._request_ids = itertools.count(1)
+        self._resync_task = None
+        # États optimistes en attente de confirmation par la carte
+        self._optimistic = {}
 
     async def ensure_websocket_connection(self):
+        # Les messages poussés par l'addon sont traités à part des réponses
+        if self.messages_task is None or self.messages_task.done():
+            self.messages_task = self.hass.async_create_task(self.process_messages())
         while True:
             try:
                 await self.start_websocket()
             except Exception as e:
                 _LOGGER.error(f"WebSocket connection error: {e}")
-                await asyncio.sleep(5)  # wait before retrying
+            await asyncio.sleep(5)  # wait before retrying
 
     async def start_websocket(self):
         async with websockets.connect(f'ws://localhost:{WS_PORT}') as websocket:
             self.websocket = websocket
-            await websocket.send(json.dumps({
-                "action": "init_device",
-                "device_name": self.config_entry.data["device_name"],
-                "ip_address": self.config_entry.data["ip_address"],
-                "poll_interval": self.config_entry.data["poll_interval"],
-                "unique_id": self.config_entry.data["unique_id"]
-            }))
-            asyncio.create_task(self.receive_messages(websocket))
-            await self.process_messages()
+            receiver = asyncio.create_task(self.receive_messages(websocket))
+            # Proposer le protocole compact, l'addon répond avec celui retenu
+            hello = await self.async_rpc("hello", protocols=PROTOCOLS)
+            self.protocol = hello.get("protocol")
+            await self.async_rpc(
+                "init_device",
+                device_name=self.config_entry.data["device_name"],
+                ip_address=self.config_entry.data["ip_address"],
+                poll_interval=self.config_entry.data["poll_interval"],
+                unique_id=self.config_entry.data["unique_id"]
+            )
+            # Après (re)connexion, relire l'état complet des appareils
+            await self.async_refresh()
+            await receiver
+
+    async def async_rpc(self, action, timeout=RPC_TIMEOUT, **payload):
+        """Send a request to the addon and wait for the reply carrying its id."""
+        websocket = self.websocket
+        if websocket is None:
+            raise ConnectionError("WebSocket not connected")
+        request_id = next(self._request_ids)
+        future = self.hass.loop.create_future()
+        self._pending[request_id] = future
+        try:
+            await websocket.send(json.dumps({"action": action, "id": request_id, **payload}))
+            return await asyncio.wait_for(future, timeout)
+        except websockets.exceptions.ConnectionClosed as e:
+            # Les appelants ne gèrent que ConnectionError (rollback optimiste, retry)
+            raise ConnectionError(f"WebSocket connection closed: {e}") from e
+        finally:
+            self._pending.pop(request_id, None)
 
     async def receive_messages(self, websocket):
         try:
             async for message in websocket:
-                await self.message_queue.put(message)
+                data = decode_message(message)
+                future = self._pending.get(data.get("id"))
+                if future is None:
+                    await self.message_queue.put(data)
+                elif not future.done():
+                    if data.get("action") == "error":
+                        future.set_exception(RuntimeError(data.get("error")))
+                    else:
+                        future.set_result(data)
         except websockets.exceptions.ConnectionClosedError as e:
             _LOGGER.error(f"WebSocket connection closed with error: {e}")
         except Exception as e:
             _LOGGER.error(f"Unexpected error in WebSocket connection: {e}")
+        finally:
+            if self.websocket is websocket:
+                self.websocket = None
+            # Aucune réponse n'arrivera plus : échouer tout de suite les requêtes en attente
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("WebSocket connection closed"))
 
     async def process_messages(self):
         while True:
-            message = await self.message_queue.get()
-            await self.handle_websocket_message(message)
+            data = await self.message_queue.get()
+            try:
+                await self.handle_websocket_message(data)
+            except Exception as e:
+                _LOGGER.error(f"Error handling WebSocket message: {e}")
 
-    async def handle_websocket_message(self, message):
-        data = json.loads(message)
+    async def handle_websocket_message(self, data):
         # Ensure 'leds' key is always present
         if 'leds' not in data:
             data['leds'] = {}
         # Handle the incoming message from the WebSocket
-        _LOGGER.info(f"Received message from WebSocket: {data}")
-        self.async_set_updated_data(data)
+        _LOGGER.debug(f"Received message from WebSocket: {data}")
+        if self._apply_message(data):
+            self.async_set_updated_data(data)
+
+    def _apply_message(self, data):
+        ip_address = data.get("ip_address")
+        if ip_address is not None and ip_address != self.config_entry.data["ip_address"]:
+            # Message concernant une autre carte
+            return False
+        action = data.get("action")
+        if action == "data":
+            for device in data.get("devices", []):
+                self._index_device(device)
+                if device["device_name"] not in self._optimistic:
+                    self.device_states[device["device_name"]] = device.get("state", "off")
+            # L'état des LED publié par la carte fait foi sur l'état en base
+            self._apply_led_status()
+        elif action == "update_entity_state":
+            device_name = self._entity_devices.get(data.get("entity_id"))
+            if device_name is not None:
+                # Un appui sur le bouton l'emporte sur une commande en attente
+                self._clear_optimistic(device_name)
+                self.device_states[device_name] = data["state"]
+        elif action == "status_update":
+            self.status = dict(data.get("status", {}))
+            self.status_seq = data.get("seq")
+            self._apply_led_status()
+        elif action == "status_delta":
+            seq = data.get("seq")
+            if seq != (self.status_seq or 0) + 1:
+                # Delta manquant : appliquer celui-ci puis redemander un snapshot
+                _LOGGER.debug(f"Status sequence gap ({self.status_seq} -> {seq}), resyncing")
+                self._schedule_resync()
+            self.status.update(data.get("changes", {}))
+            self.status_seq = seq
+            self._apply_led_status()
+        elif action == "button_event":
+            # Exposé aux automatisations ; les entités ne changent pas
+            self.hass.bus.async_fire(f"{DOMAIN}_button", {
+                "ip_address": ip_address,
+                "button": data.get("button"),
+                "state": data.get("state"),
+                "edges": data.get("edges"),
+                "presses": data.get("presses"),
+            })
+            return False
+        return True
+
+    def _schedule_resync(self):
+        if self._resync_task is None or self._resync_task.done():
+            self._resync_task = self.hass.async_create_task(self.async_resync())
+
+    async def async_resync(self):
+        try:
+            await self.async_rpc("resync", ip_address=self.config_entry.data["ip_address"])
+        except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+            _LOGGER.warning(f"Resync failed: {e}")
+
+    def _apply_led_status(self):
+        status = self.status
+        for device_name, leds in self._device_leds.items():
+            pending = self._optimistic.get(device_name)
+            if pending is not None:
+                leds = pending["leds"]
+            values = [status.get(led) for led in leds]
+            if not leds or None in values:
+                continue
+            if pending is not None:
+                expected = "1" if pending["state"] == "on" else "0"
+                if any(value != expected for value in values):
+                    # Pas encore confirmé par la carte : garder l'état optimiste
+                    continue
+                self._clear_optimistic(device_name)
+            self.device_states[device_name] = "on" if all(value == "1" for value in values) else "off"
+
+    def set_optimistic(self, device_name, state, leds):
+        """Show state right away, until the board's LEDs confirm it or it times out."""
+        pending = self._optimistic.pop(device_name, None)
+        if pending is not None:
+            pending["cancel"]()
+            previous = pending["previous"]
+        else:
+            previous = self.device_states.get(device_name, "off")
+        self._device_leds.setdefault(device_name, list(leds))
+        self.device_states[device_name] = state
+        self._optimistic[device_name] = {
+            "state": state,
+            "leds": list(leds),
+            "previous": previous,
+            "cancel": async_call_later(self.hass, OPTIMISTIC_TIMEOUT, partial(self._optimistic_timeout, device_name)),
+        }
+        # LED déjà dans l'état demandé : aucun delta ne viendra, confirmer tout de suite
+        self._apply_led_status()
+        self.async_update_listeners()
+
+    def rollback_optimistic(self, device_name, reason):
+        pending = self._optimistic.get(device_name)
+        if pending is None:
+            return
+        self._clear_optimistic(device_name)
+        _LOGGER.error(f"{device_name}: {reason}, rolling back to {pending['previous']}")
+        self.device_states[device_name] = pending["previous"]
+        # Si la carte a déjà publié l'état de ses LED, il fait foi
+        self._apply_led_status()
+        self.async_update_listeners()
+
+    def _clear_optimistic(self, device_name):
+        pending = self._optimistic.pop(device_name, None)
+        if pending is not None:
+            pending["cancel"]()
+
+    @callback
+    def _optimistic_timeout(self, device_name, _now):
+        self.rollback_optimistic(device_name, f"state not confirmed by the board within {OPTIMISTIC_TIMEOUT}s")
+
+    def _index_device(self, device):
+        device_name = device["device_name"]
+        self._device_leds[device_name] = list(device["select_leds"])
+        self._entity_devices[f"light.{clean_entity_name(device_name)}"] = device_name
+
+    def get_device_state(self, device_name):
+        state = self.device_states.get(device_name)
+        if state is None:
+            # Appareil inconnu de la table en mémoire : relire la base une fois
+            if self._rebuild_task is None or self._rebuild_task.done():
+                self._rebuild_task = self.hass.async_create_task(self.async_rebuild_states())
+            return "off"
+        return state
+
+    async def async_rebuild_states(self):
+        invalidate_devices(self.hass)
+        devices = await self.load_devices()
+        if devices is not None:
+            self.async_update_listeners()
+        return devices
 
     async def _async_update_data(self):
         now = datetime.now()
         if self._last_update is not None:
             elapsed = now - self._last_update
-            _LOGGER.info(f"Data updated. {elapsed.total_seconds() / 60:.2f} minutes elapsed since last update.")
+            _LOGGER.debug(f"Data updated. {elapsed.total_seconds() / 60:.2f} minutes elapsed since last update.")
         self._last_update = now
-        _LOGGER.info("Fetching new data from IPX800 Docker")
+        _LOGGER.debug("Fetching new data from IPX800 Docker")
         # demander via le websocket les data pour l'integration
         if self.websocket:
-            await self.websocket.send(json.dumps({"action": "get_data"}))
-            data = await self.message_queue.get()
-            data = json.loads(data)
+            try:
+                data = await self.async_rpc("get_data", ip_address=self.config_entry.data["ip_address"])
+            except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+                raise UpdateFailed(f"get_data failed: {e}") from e
             # Ensure 'leds' key is always present
             if 'leds' not in data:
                 data['leds'] = {}
+            self._apply_message(data)
             return data
         return {}
 
     async def load_devices(self):
-        ip_address = self.config_entry.data["ip_address"]
-        db_path = f"/config/ipx800_{ip_address}.db"
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT DISTINCT device_name, input_button, select_leds, unique_id, variable_etat_name FROM devices')
-        rows = cursor.fetchall()
+        """Devices of this board from the addon database, None when it cannot be read."""
+        all_devices = await async_get_all_devices(self.hass)
+        if all_devices is None:
+            return None
+        rows = all_devices.get(self.config_entry.data["ip_address"], [])
         devices = []
         for row in rows:
-            devices.append({
+            device = {
                 "device_name": row[0],
                 "input_button": row[1],
-                "select_leds": row[2].split(","),
+                "select_leds": mask_to_leds(row[2]),
                 "unique_id": row[3],
                 "variable_etat_name": row[4]
-            })
-        conn.close()
+            }
+            devices.append(device)
+            self._index_device(device)
+            self.device_states[device["device_name"]] = row[5] or "off"
+        self._apply_led_status()
         return devices
 
+async def async_get_all_devices(hass):
+    """Devices of every board by IP address, read once and shared by all entries.
+
+    None when the database cannot be read yet; that result is not kept.
+    """
+    cached = hass.data.get(DEVICES_DATA)
+    if cached is None or time.monotonic() - cached[0] > DEVICES_TTL:
+        # Une seule lecture en cours : les entrées qui démarrent ensemble l'attendent
+        cached = (time.monotonic(), hass.async_add_executor_job(read_all_devices))
+        hass.data[DEVICES_DATA] = cached
+    devices = await asyncio.shield(cached[1])
+    if devices is None and hass.data.get(DEVICES_DATA) is cached:
+        invalidate_devices(hass)
+    return devices
+
+@callback
+def invalidate_devices(hass):
+    hass.data.pop(DEVICES_DATA, None)
+
+def read_all_devices():
+    """{ip_address: rows} of every board; None when the database cannot be read."""
+    devices = {}
+    try:
+        # Lecture seule : l'addon est seul à écrire dans la base
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    except sqlite3.OperationalError as e:
+        _LOGGER.warning(f"No database at {DB_PATH} yet: {e}")
+        return None
+    try:
+        cursor = conn.execute('''
+            SELECT b.ip_address, d.device_name, d.input_button, d.led_mask, d.unique_id, d.variable_etat_name, d.state
+            FROM devices d JOIN boards b ON b.id = d.board_id
+            ORDER BY d.board_id, d.id
+        ''')
+        for row in cursor:
+            devices.setdefault(row[0], []).append(row[1:])
+    except sqlite3.OperationalError as e:
+        # Base pas encore créée ou migrée par l'addon
+        _LOGGER.warning(f"No devices table in {DB_PATH} yet: {e}")
+        return None
+    except sqlite3.Error as e:
+        # Base verrouillée ou illisible : surtout ne pas la prendre pour vide
+        _LOGGER.error(f"Error reading devices from {DB_PATH}: {e}")
+        return None
+    finally:
+        conn.close()
+    return devices
+
 class IPX800View(HomeAssistantView):
     url = "/api/ipx800_update"
     name = "api:ipx800_update"
@@ -3,12 +3,10 @@ import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.core import callback
 from homeassistant.helpers import config_validation as cv
-import sqlite3
-import os
+import asyncio
 import uuid
-import json
-import websockets
-from .const import DOMAIN, IP_ADDRESS, POLL_INTERVAL, WEBSOCKET_URL, WS_PORT
+from .const import DOMAIN, PUSH_MODE, WS_PORT
+from . import invalidate_devices
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -25,44 +23,18 @@ class IPX800ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             device_name = user_input["device_name"]
             ip_address = user_input["ip_address"]
             poll_interval = user_input["poll_interval"]
+            push_mode = user_input.get("push_mode", PUSH_MODE)
             unique_id = str(uuid.uuid4())
             websocket_url = f"ws://localhost:{WS_PORT}"
 
-            db_path = f"/config/ipx800_{ip_address}.db"
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS infos (
-                    device_name TEXT,
-                    ip_address TEXT,
-                    poll_interval INTEGER,
-                    unique_id TEXT
-                )
-            ''')
-            cursor.execute('''
-                INSERT INTO infos (device_name, ip_address, poll_interval, unique_id)
-                VALUES (?, ?, ?, ?)
-            ''', (device_name, ip_address, poll_interval, unique_id))
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS devices (
-                    device_name TEXT,
-                    input_button TEXT,
-                    select_leds TEXT,
-                    unique_id TEXT,
-                    variable_etat_name TEXT,
-                    ip_address TEXT,
-                    state TEXT DEFAULT 'off'
-                )
-            ''')
-            conn.commit()
-            conn.close()
-
+            # Les tables sont créées par l'addon (migrations) au premier init_device
             return self.async_create_entry(
                 title=device_name,
                 data={
                     "device_name": device_name,
                     "ip_address": ip_address,
                     "poll_interval": poll_interval,
+                    "push_mode": push_mode,
                     "unique_id": unique_id,
                     "websocket_url": websocket_url,
                     "devices": []
@@ -74,6 +46,7 @@ class IPX800ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 vol.Required("device_name"): str,
                 vol.Required("ip_address"): str,
                 vol.Required("poll_interval", default=10): int,
+                vol.Optional("push_mode", default=PUSH_MODE): bool,
             })
         )
 
@@ -87,57 +60,48 @@ class IPX800OptionsFlowHandler(config_entries.OptionsFlow):
         self.config_entry = config_entry
 
     async def async_step_init(self, user_input=None):
-        return await self.async_step_add_device()
+        return self.async_show_menu(step_id="init", menu_options=["add_device", "settings"])
 
-    async def async_step_add_device(self, user_input=None):
+    async def async_step_settings(self, user_input=None):
         if user_input is not None:
-            conn = sqlite3.connect(f"/config/ipx800_{self.config_entry.data['ip_address']}.db")
-            cursor = conn.cursor()
-
-            devices = self.config_entry.data.get("devices", [])
-            new_device = {
-                "device_name": user_input["device_name"],
-                "input_button": user_input["input_button"],
-                "select_leds": user_input["select_leds"]
-            }
-
-            cursor.execute('''
-                SELECT COUNT(*) FROM devices WHERE device_name = ? AND ip_address = ?
-            ''', (user_input["device_name"], self.config_entry.data["ip_address"]))
-            if cursor.fetchone()[0] == 0:
-                devices.append(new_device)
-                cursor.execute('''
-                    INSERT INTO devices (device_name, input_button, select_leds, unique_id, variable_etat_name, ip_address, state)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    user_input["device_name"],
-                    user_input["input_button"],
-                    ",".join(user_input["select_leds"]),
-                    self.config_entry.data["unique_id"],
-                    f'etat_{clean_entity_name(user_input["device_name"])}',
-                    self.config_entry.data["ip_address"],
-                    'off'
-                ))
-                conn.commit()
-                conn.close()
-
-                self.hass.config_entries.async_update_entry(self.config_entry, data={**self.config_entry.data, "devices": devices})
+            data = {**self.config_entry.data, "push_mode": user_input["push_mode"]}
+            self.hass.config_entries.async_update_entry(self.config_entry, data=data)
+            # Le coordinateur relit push_mode à sa création
+            await self.hass.config_entries.async_reload(self.config_entry.entry_id)
+            return self.async_create_entry(title="", data={})
 
-                await add_new_entities(self.hass, self.config_entry, [new_device])
+        return self.async_show_form(
+            step_id="settings",
+            data_schema=vol.Schema({
+                vol.Required("push_mode", default=self.config_entry.data.get("push_mode", False)): bool,
+            })
+        )
 
-                async with websockets.connect(f'ws://localhost:{WS_PORT}') as websocket:
-                    await websocket.send(json.dumps({
-                        "action": "add_device",
-                        "device_name": user_input["device_name"],
-                        "input_button": user_input["input_button"],
-                        "select_leds": user_input["select_leds"],
-                        "unique_id": self.config_entry.data["unique_id"],
-                        "variable_etat_name": f'etat_{clean_entity_name(user_input["device_name"])}',
-                        "ip_address": self.config_entry.data["ip_address"]
-                    }))
+    async def async_step_add_device(self, user_input=None):
+        errors = {}
+        if user_input is not None:
+            coordinator = self.hass.data[DOMAIN].get(self.config_entry.entry_id)
+            try:
+                # L'addon est seul à écrire dans la base
+                result = await coordinator.async_rpc(
+                    "add_device",
+                    device_name=user_input["device_name"],
+                    input_button=user_input["input_button"],
+                    select_leds=user_input["select_leds"],
+                    unique_id=self.config_entry.data["unique_id"],
+                    variable_etat_name=f'etat_{clean_entity_name(user_input["device_name"])}',
+                    ip_address=self.config_entry.data["ip_address"]
+                )
+            except (AttributeError, asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+                _LOGGER.error(f"Error adding device {user_input['device_name']}: {e}")
+                errors["base"] = "cannot_connect"
+            else:
+                if result.get("added"):
+                    invalidate_devices(self.hass)
+                    # Le rechargement réconcilie les entités et crée celles du nouvel appareil
+                    await self.hass.config_entries.async_reload(self.config_entry.entry_id)
+                return self.async_create_entry(title="", data={})
 
-            return self.async_create_entry(title="", data={})
-            
         return self.async_show_form(
             step_id="add_device",
             data_schema=vol.Schema({
@@ -153,13 +117,6 @@ class IPX800OptionsFlowHandler(config_entries.OptionsFlow):
                     "led6": "LED 6",
                     "led7": "LED 7",
                 }),
-            })
+            }),
+            errors=errors
         )
-
-async def add_new_entities(hass, config_entry, devices):
-    await hass.config_entries.async_forward_entry_setups(config_entry, ["light", "sensor"])
-    for device in devices:
-        entity_id_light = f"light.{clean_entity_name(device['device_name'])}_light"
-        entity_id_sensor = f"sensor.{clean_entity_name(device['device_name'])}_light_sensor"
-        hass.states.async_set(entity_id_light, "off")
-        hass.states.async_set(entity_id_sensor, "off")
@@ -1,5 +1,7 @@
 # Domaine de l'intégration
 DOMAIN = "ipx800_v1"
+# Plateformes chargées pour chaque entrée
+PLATFORMS = ["light", "sensor"]
 # Constantes pour les clés de configuration
 IP_ADDRESS = "ip_address"
 POLL_INTERVAL = "poll_interval"
@@ -9,3 +11,15 @@ WEBSOCKET_URL = "http://localhost:6789"
 APP_PORT = 5213
 # Port utilisé par websocket
 WS_PORT  = 6789
+# Délai maximal d'attente d'une réponse de l'addon (secondes)
+RPC_TIMEOUT = 10
+# Mode push : le coordinateur ne relance pas get_data périodiquement
+PUSH_MODE = True
+# Délai de confirmation d'un état optimiste par la carte (secondes)
+OPTIMISTIC_TIMEOUT = 5
+# Base de l'addon, partagée par toutes les cartes
+DB_PATH = "/config/ipx800.db"
+# Clé de hass.data pour les appareils de toutes les cartes, lus en une requête
+DEVICES_DATA = f"{DOMAIN}_devices"
+# Durée de validité de cette lecture (secondes) : couvre le démarrage des entrées
+DEVICES_TTL = 5
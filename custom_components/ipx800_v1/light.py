@@ -2,10 +2,8 @@ import logging
 from homeassistant.components.light import LightEntity
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.entity import DeviceInfo
-from homeassistant.helpers.entity_registry import async_get as async_get_entity_registry
 from .const import DOMAIN
-import json
-import sqlite3
+import asyncio
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -22,18 +20,12 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     if not devices:
         _LOGGER.warning("No devices found in config entry data.")
 
-    entity_registry = async_get_entity_registry(hass)
-
     for device in devices:
         device_name = device["device_name"]
         input_button = device["input_button"]
         select_leds = device["select_leds"]
         unique_id = f"{config_entry.entry_id}_{clean_entity_name(device_name)}_light"
 
-        if unique_id in entity_registry.entities:
-            _LOGGER.warning(f"Entity with unique_id {unique_id} already exists. Skipping.")
-            continue
-
         _LOGGER.debug(f"Adding light entity: {device_name} Light")
         entities.append(IPX800Light(coordinator, config_entry, device_name, input_button, select_leds, unique_id))
 
@@ -87,35 +79,38 @@ class IPX800Light(IPX800Base, LightEntity):
 
     @property
     def is_on(self):
-        db_path = f"/config/ipx800_{self.coordinator.config_entry.data['ip_address']}.db"
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT state FROM devices WHERE device_name = ?", (self._name,))
-        variable_state = cursor.fetchone()[0]
-        conn.close()
-        return variable_state == 'on'
+        return self.coordinator.get_device_state(self._name) == 'on'
 
     async def async_turn_on(self, **kwargs):
-        await self._set_led_state(True)
+        # L'interface bascule tout de suite, la carte confirme ensuite
+        self.coordinator.set_optimistic(self._name, "on", self._select_leds)
         self._is_on = True
-        await self.coordinator.async_request_refresh()
+        await self._set_led_state(True)
+        if not self.coordinator.push_mode:
+            await self.coordinator.async_request_refresh()
 
     async def async_turn_off(self, **kwargs):
-        await self._set_led_state(False)
+        self.coordinator.set_optimistic(self._name, "off", self._select_leds)
         self._is_on = False
-        await self.coordinator.async_request_refresh()
+        await self._set_led_state(False)
+        if not self.coordinator.push_mode:
+            await self.coordinator.async_request_refresh()
 
     async def _set_led_state(self, state):
-        if self.coordinator.websocket:
-            payload = {
-                "action": "set_led_state",
-                "leds": self._select_leds,
-                "state": state,
-                "variable_etat_name": self._variable_etat_name,
-                "ip_address": self.coordinator.config_entry.data["ip_address"],
-                "device_name": self._name
-            }
-            await self.coordinator.websocket.send(json.dumps(payload))
+        try:
+            result = await self.coordinator.async_rpc(
+                "set_led_state",
+                leds=self._select_leds,
+                state=state,
+                variable_etat_name=self._variable_etat_name,
+                ip_address=self.coordinator.config_entry.data["ip_address"],
+                device_name=self._name
+            )
+        except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+            self.coordinator.rollback_optimistic(self._name, f"set_led_state failed: {e}")
+            return
+        if not result.get("ok", True):
+            self.coordinator.rollback_optimistic(self._name, f"board refused LED write {result.get('leds')}")
 
     @property
     def supported_color_modes(self):
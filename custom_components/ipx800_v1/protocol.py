@@ -0,0 +1,34 @@
+import json
+
+# Doit rester identique à STATUS_TAGS dans ipx800_v1_addon/status_parser.py
+STATUS_TAGS = (
+    "led0", "led1", "led2", "led3", "led4", "led5", "led6", "led7",
+    "btn0", "btn1", "btn2", "btn3",
+    "an0", "an1",
+    "count0", "count1", "count2",
+)
+
+# Protocoles proposés à l'addon, par ordre de préférence
+JSON = "json"
+COMPACT_V1 = "compact1"
+PROTOCOLS = [COMPACT_V1, JSON]
+
+KIND_DELTA = 1
+
+
+def decode_message(text):
+    """Decode an addon message, JSON or compact1, to its JSON dict form."""
+    data = json.loads(text)
+    if not isinstance(data, list):
+        return data
+    # compact1 : [kind, ip_address, seq, [tag, value, ...]]
+    kind, ip_address, seq, packed = data
+    status = {}
+    for index in range(0, len(packed), 2):
+        tag, value = packed[index], packed[index + 1]
+        if isinstance(tag, int):
+            tag = STATUS_TAGS[tag]
+        status[tag] = str(value) if isinstance(value, int) else value
+    if kind == KIND_DELTA:
+        return {"action": "status_delta", "ip_address": ip_address, "seq": seq, "changes": status}
+    return {"action": "status_update", "ip_address": ip_address, "seq": seq, "status": status}
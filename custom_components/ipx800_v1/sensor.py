@@ -2,8 +2,6 @@ import logging
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.entity import DeviceInfo
-from homeassistant.helpers.entity_registry import async_get as async_get_entity_registry
-import sqlite3
 from .const import DOMAIN
 
 _LOGGER = logging.getLogger(__name__)
@@ -21,17 +19,11 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     if not devices:
         _LOGGER.warning("No devices found in config entry data.")
 
-    entity_registry = async_get_entity_registry(hass)
-
     for device in devices:
         device_name = device["device_name"]
         select_leds = device["select_leds"]
         unique_id = f"{config_entry.entry_id}_{clean_entity_name(device_name)}_light_sensor"
 
-        if unique_id in entity_registry.entities:
-            _LOGGER.warning(f"Entity with unique_id {unique_id} already exists. Skipping.")
-            continue
-
         _LOGGER.debug(f"Adding sensor entity: {device_name} Light Sensor")
         entities.append(IPX800LightSensor(coordinator, config_entry, device_name, select_leds, unique_id))
 
@@ -83,10 +75,4 @@ class IPX800LightSensor(IPX800Base, SensorEntity):
 
     @property
     def state(self):
-        db_path = f"/config/ipx800_{self.coordinator.config_entry.data['ip_address']}.db"
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT state FROM devices WHERE device_name = ?", (self._name,))
-        variable_state = cursor.fetchone()[0]
-        conn.close()
-        return "on" if variable_state == 'on' else "off"
+        return "on" if self.coordinator.get_device_state(self._name) == 'on' else "off"
@@ -0,0 +1,170 @@
+from status_parser import STATUS_TAGS
+
+DEFAULT_DEBOUNCE = 0.05
+TOGGLE_ON_EDGE = "edge"
+TOGGLE_ON_PRESS = "press"
+
+BUTTON_TAGS = tuple(tag for tag in STATUS_TAGS if tag.startswith("btn"))
+
+_settings = {
+    "debounce": DEFAULT_DEBOUNCE,
+    "counters": {},
+    "toggle_on": TOGGLE_ON_EDGE,
+}
+_detectors = {}
+
+
+class ButtonEvent:
+    """Edges of one button seen (or inferred) between two polls."""
+
+    __slots__ = ("button", "state", "edges", "presses", "toggles")
+
+    def __init__(self, button, state, edges, presses, toggles):
+        self.button = button
+        self.state = state
+        self.edges = edges
+        self.presses = presses
+        self.toggles = toggles
+
+    def as_message(self, ip_address):
+        return {
+            "action": "button_event",
+            "ip_address": ip_address,
+            "button": self.button,
+            "state": self.state,
+            "edges": self.edges,
+            "presses": self.presses,
+        }
+
+
+class ButtonDetector:
+    """Button edge detector for the polling path of one board.
+
+    - the first value seen for a button is its baseline (and its released
+      value): nothing fires on startup;
+    - a change seen less than `debounce` seconds after the previous edge is
+      held back until a later poll confirms it;
+    - when a button has a counter, the counter delta gives the number of
+      presses, including those that happened entirely between two polls.
+    """
+
+    def __init__(self, ip_address, debounce, counters, toggle_on):
+        self.ip_address = ip_address
+        self._debounce = debounce
+        self._counters = counters
+        self._toggle_on = toggle_on
+        self._released = {}
+        self._state = {}
+        self._count = {}
+        self._last_edge = {}
+        self.events = 0
+        self.inferred = 0
+
+    def update(self, record, now):
+        """Compare a parsed status with the last accepted one, return ButtonEvents."""
+        events = []
+        for button in BUTTON_TAGS:
+            value = record.get(button)
+            if value is None:
+                continue
+            counter = self._counters.get(button)
+            count = _to_int(record.get(counter)) if counter else None
+            if button not in self._state:
+                # Référence : état de repos et compteur au démarrage
+                self._released[button] = value
+                self._state[button] = value
+                self._count[button] = count
+                continue
+            changed = value != self._state[button]
+            if changed and now - self._last_edge.get(button, float("-inf")) < self._debounce:
+                # Rebond probable : attendre un poll suivant pour confirmer
+                continue
+            presses = self._counted_presses(button, count)
+            edges = self._counted_edges(button, value, presses)
+            if edges is None:
+                presses = 1 if changed and value != self._released[button] else 0
+                edges = 1 if changed else 0
+            elif edges > changed:
+                self.inferred += 1
+            if not edges:
+                continue
+            self._state[button] = value
+            self._last_edge[button] = now
+            self.events += 1
+            toggles = presses if self._toggle_on == TOGGLE_ON_PRESS else edges
+            events.append(ButtonEvent(button, value, edges, presses, toggles))
+        return events
+
+    def _counted_presses(self, button, count):
+        """Presses since the last event according to the counter, None without one."""
+        last = self._count.get(button)
+        if count is None:
+            return None
+        self._count[button] = count
+        if last is None or count < last:
+            # Compteur absent jusqu'ici, ou remis à zéro (redémarrage de la carte)
+            return None
+        return count - last
+
+    def _counted_edges(self, button, value, presses):
+        """Edges implied by the counted presses, None when they cannot be trusted."""
+        if presses is None:
+            return None
+        released = self._released[button]
+        was_pressed = self._state[button] != released
+        is_pressed = value != released
+        # Chaque appui compté est un front d'appui suivi d'un front de relâchement
+        edges = 2 * presses - is_pressed + was_pressed
+        # Compteur incohérent avec l'état lu : s'en tenir à ce qui a été vu
+        return edges if edges >= 0 else None
+
+    def stats(self):
+        return {
+            "ip_address": self.ip_address,
+            "state": dict(self._state),
+            "events": self.events,
+            "inferred": self.inferred,
+        }
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_counters(text):
+    """'btn0:count0,btn1:count1' -> {"btn0": "count0", "btn1": "count1"}"""
+    counters = {}
+    for pair in (text or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        button, _, counter = pair.partition(":")
+        button, counter = button.strip(), counter.strip()
+        if button not in BUTTON_TAGS or counter not in STATUS_TAGS or not counter.startswith("count"):
+            raise ValueError(f"Invalid button counter mapping: {pair}")
+        counters[button] = counter
+    return counters
+
+
+def configure(debounce=None, counters=None, toggle_on=None):
+    if debounce is not None:
+        _settings["debounce"] = debounce
+    if counters is not None:
+        _settings["counters"] = counters
+    if toggle_on is not None:
+        _settings["toggle_on"] = toggle_on
+
+
+def get_detector(ip_address):
+    detector = _detectors.get(ip_address)
+    if detector is None:
+        detector = ButtonDetector(ip_address, **_settings)
+        _detectors[ip_address] = detector
+    return detector
+
+
+def detector_stats():
+    return [detector.stats() for detector in _detectors.values()]
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+import relays
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_SPACING = 0.05
+
+_settings = {"min_spacing": DEFAULT_MIN_SPACING}
+_queues = {}
+
+
+class BoardCommandQueue:
+    """Serialized LED writes for one board.
+
+    Commands waiting for the board are merged per LED, so a newer command
+    for a LED replaces the pending one (last write wins) and the whole
+    pending set goes out as one write. Writes are spaced by at least
+    `min_spacing` seconds to spare the board's embedded web server.
+    """
+
+    def __init__(self, ip_address, min_spacing):
+        self.ip_address = ip_address
+        self._min_spacing = min_spacing
+        self._pending = {}
+        self._waiters = []
+        self._task = None
+        self._last_write = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.writes = 0
+
+    def submit(self, leds):
+        """Queue {led: bool}; the returned future gets the result of the write that applied it."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        for led, on in leds.items():
+            if led in self._pending:
+                self.coalesced += 1
+            self._pending[led] = on
+        self._waiters.append((list(leds), future))
+        self.submitted += 1
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        waiters = []
+        try:
+            while self._pending:
+                if self._last_write is not None:
+                    delay = self._last_write + self._min_spacing - loop.time()
+                    if delay > 0:
+                        # Les commandes arrivées pendant l'attente seront fusionnées
+                        await asyncio.sleep(delay)
+                leds, self._pending = self._pending, {}
+                waiters, self._waiters = self._waiters, []
+                try:
+                    result = await relays.write_leds(self.ip_address, leds)
+                except Exception as e:
+                    logger.error(f"Error writing LEDs on {self.ip_address}: {e}")
+                    result = {"ip_address": self.ip_address, "ok": False, "requests": 0,
+                              "leds": {led: False for led in leds}}
+                self._last_write = loop.time()
+                self.writes += 1
+                for led_names, future in waiters:
+                    if not future.done():
+                        future.set_result(_waiter_result(result, led_names))
+        except asyncio.CancelledError:
+            # Arrêt : les appelants de submit() ne doivent pas attendre leur timeout
+            error = RuntimeError(f"LED queue of {self.ip_address} stopped")
+            for _, future in waiters + self._waiters:
+                if not future.done():
+                    future.set_exception(error)
+            self._pending, self._waiters = {}, []
+            raise
+        finally:
+            self._task = None
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self):
+        return {
+            "ip_address": self.ip_address,
+            "depth": len(self._pending),
+            "waiters": len(self._waiters),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "writes": self.writes,
+        }
+
+
+def _waiter_result(result, led_names):
+    leds = {led: result["leds"].get(led, False) for led in led_names}
+    return {
+        "ip_address": result["ip_address"],
+        "ok": all(leds.values()),
+        "requests": result["requests"],
+        "leds": leds,
+    }
+
+
+def configure(min_spacing=None):
+    if min_spacing is not None:
+        _settings["min_spacing"] = min_spacing
+
+
+def get_queue(ip_address):
+    queue = _queues.get(ip_address)
+    if queue is None:
+        queue = BoardCommandQueue(ip_address, **_settings)
+        _queues[ip_address] = queue
+    return queue
+
+
+def stop_all():
+    for queue in _queues.values():
+        queue.stop()
+
+
+def queue_stats():
+    return [queue.stats() for queue in _queues.values()]
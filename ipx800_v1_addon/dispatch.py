@@ -0,0 +1,45 @@
+from storage import mask_to_leds
+
+# (ip_address, input_button) -> [DeviceEntry]
+_buttons = {}
+# (ip_address, device_name) -> DeviceEntry
+_devices = {}
+_loaded = set()
+
+
+class DeviceEntry:
+    """A configured device with everything a button edge needs, precomputed."""
+
+    __slots__ = ("device_name", "input_button", "led_mask", "leds", "entity_id", "state")
+
+    def __init__(self, device_name, input_button, led_mask, entity_id, state):
+        self.device_name = device_name
+        self.input_button = input_button
+        self.led_mask = led_mask
+        self.leds = mask_to_leds(led_mask)
+        self.entity_id = entity_id
+        self.state = state
+
+
+def is_loaded(ip_address):
+    return ip_address in _loaded
+
+
+def set_board(ip_address, entries):
+    """Replace the dispatch table of one board."""
+    for key in [key for key in _devices if key[0] == ip_address]:
+        del _devices[key]
+    for key in [key for key in _buttons if key[0] == ip_address]:
+        del _buttons[key]
+    for entry in entries:
+        _devices[(ip_address, entry.device_name)] = entry
+        _buttons.setdefault((ip_address, entry.input_button), []).append(entry)
+    _loaded.add(ip_address)
+
+
+def devices_for_button(ip_address, input_button):
+    return _buttons.get((ip_address, input_button), ())
+
+
+def get_device(ip_address, device_name):
+    return _devices.get((ip_address, device_name))
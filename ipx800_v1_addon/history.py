@@ -0,0 +1,259 @@
+import array
+import asyncio
+import logging
+import time
+
+from status_parser import STATUS_TAGS, TAG_INDEX
+import storage
+from storage import get_database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 30.0
+DEFAULT_RAW_DAYS = 7
+DEFAULT_MINUTE_DAYS = 30
+DEFAULT_HOUR_DAYS = 365
+PRUNE_INTERVAL = 3600
+
+RAW = "raw"
+MINUTE = "minute"
+HOUR = "hour"
+RESOLUTIONS = (RAW, MINUTE, HOUR)
+# Table et durée en secondes de chaque agrégat
+ROLLUPS = {MINUTE: ("history_minute", 60), HOUR: ("history_hour", 3600)}
+
+# Valeurs textuelles du status.xml ramenées à des nombres
+_WORDS = {"up": 0.0, "dn": 1.0, "off": 0.0, "on": 1.0}
+
+_settings = {
+    "enabled": True,
+    "flush_interval": DEFAULT_FLUSH_INTERVAL,
+    "raw_days": DEFAULT_RAW_DAYS,
+    "minute_days": DEFAULT_MINUTE_DAYS,
+    "hour_days": DEFAULT_HOUR_DAYS,
+}
+_histories = {}
+
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _WORDS.get(value)
+
+
+class Rollup:
+    """Running avg/min/max per tag over the current period, one array slot per tag."""
+
+    def __init__(self, period):
+        self.period = period
+        self.start = None
+        size = len(STATUS_TAGS)
+        self.sum = array.array("d", [0.0]) * size
+        self.min = array.array("d", [0.0]) * size
+        self.max = array.array("d", [0.0]) * size
+        self.count = array.array("l", [0]) * size
+
+    def add(self, now, numbers, rows):
+        start = int(now // self.period) * self.period
+        if start != self.start:
+            self.drain(rows)
+            self.start = start
+        for index, value in numbers:
+            if self.count[index]:
+                if value < self.min[index]:
+                    self.min[index] = value
+                elif value > self.max[index]:
+                    self.max[index] = value
+            else:
+                self.min[index] = self.max[index] = value
+            self.sum[index] += value
+            self.count[index] += 1
+
+    def drain(self, rows):
+        """Move the current period to rows as (tag, ts, avg, min, max, count)."""
+        for index, count in enumerate(self.count):
+            if count:
+                rows.append((index, self.start, self.sum[index] / count, self.min[index], self.max[index], count))
+                self.sum[index] = 0.0
+                self.count[index] = 0
+
+
+class BoardHistory:
+    """Append-only history of one board, buffered in arrays.
+
+    Raw samples are only kept when a value changes; every poll feeds the
+    minute and hour rollups. Buffers go to SQLite every `flush_interval`
+    seconds in a single storage call.
+    """
+
+    def __init__(self, ip_address, flush_interval):
+        self.ip_address = ip_address
+        self._flush_interval = flush_interval
+        self._ts = array.array("d")
+        self._tags = array.array("B")
+        self._values = array.array("d")
+        self._rollups = {resolution: Rollup(period) for resolution, (_, period) in ROLLUPS.items()}
+        self._rows = {resolution: [] for resolution in ROLLUPS}
+        self._flush_handle = None
+        self._last_prune = 0.0
+        self.samples = 0
+        self.flushes = 0
+
+    def record(self, record, changes, now):
+        numbers = []
+        for index, value in enumerate(record.values):
+            if value is None:
+                continue
+            number = to_number(value)
+            if number is None:
+                continue
+            numbers.append((index, number))
+            if STATUS_TAGS[index] in changes:
+                self._ts.append(now)
+                self._tags.append(index)
+                self._values.append(number)
+                self.samples += 1
+        for resolution, rollup in self._rollups.items():
+            rollup.add(now, numbers, self._rows[resolution])
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self._flush_interval, self._flush_later, loop)
+
+    def _flush_later(self, loop):
+        self._flush_handle = None
+        loop.create_task(self.flush())
+
+    async def flush(self, final=False):
+        """Write buffered samples and finished rollups; with final, also the current periods."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if final:
+            for resolution, rollup in self._rollups.items():
+                rollup.drain(self._rows[resolution])
+        raw = list(zip(self._ts, self._tags, self._values))
+        del self._ts[:], self._tags[:], self._values[:]
+        rows, self._rows = self._rows, {resolution: [] for resolution in ROLLUPS}
+        cutoffs = None
+        now = time.time()
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            cutoffs = {
+                RAW: now - _settings["raw_days"] * 86400,
+                MINUTE: now - _settings["minute_days"] * 86400,
+                HOUR: now - _settings["hour_days"] * 86400,
+            }
+        if not raw and not any(rows.values()) and cutoffs is None:
+            return
+        try:
+            await get_database().run(_write_history, self.ip_address, raw, rows, cutoffs, commit=True)
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"Error writing history of {self.ip_address}: {e}")
+
+    async def query(self, tags, start, end, resolution):
+        """Series of each tag between start and end, as parallel arrays."""
+        await self.flush()
+        rows = await get_database().run(
+            _read_history, self.ip_address, resolution, [TAG_INDEX[tag] for tag in tags], start, end
+        )
+        series = {}
+        if resolution == RAW:
+            for tag, ts, value in rows:
+                column = series.setdefault(STATUS_TAGS[tag], {"ts": [], "value": []})
+                column["ts"].append(round(ts, 3))
+                column["value"].append(value)
+        else:
+            for tag, ts, avg, min_value, max_value in rows:
+                column = series.setdefault(STATUS_TAGS[tag], {"ts": [], "avg": [], "min": [], "max": []})
+                column["ts"].append(ts)
+                column["avg"].append(round(avg, 3))
+                column["min"].append(min_value)
+                column["max"].append(max_value)
+        return series
+
+    def stats(self):
+        return {
+            "ip_address": self.ip_address,
+            "buffered": len(self._ts),
+            "samples": self.samples,
+            "flushes": self.flushes,
+        }
+
+
+def _write_history(conn, ip_address, raw, rows, cutoffs):
+    board = storage.board_id(conn, ip_address)
+    if raw:
+        conn.executemany(
+            'INSERT INTO history (board_id, ts, tag, value) VALUES (?, ?, ?, ?)', [(board,) + row for row in raw]
+        )
+    for resolution, (table, _) in ROLLUPS.items():
+        if rows[resolution]:
+            # Une période déjà écrite (arrêt en cours de période) est fusionnée
+            conn.executemany(storage.rollup_merge_sql(table), [(board,) + row for row in rows[resolution]])
+    if cutoffs is not None:
+        conn.execute('DELETE FROM history WHERE board_id = ? AND ts < ?', (board, cutoffs[RAW]))
+        for resolution, (table, _) in ROLLUPS.items():
+            conn.execute(f'DELETE FROM {table} WHERE board_id = ? AND ts < ?', (board, cutoffs[resolution]))
+
+
+def _read_history(conn, ip_address, resolution, tags, start, end):
+    placeholders = ",".join("?" * len(tags))
+    if resolution == RAW:
+        table, columns = "history", "tag, ts, value"
+    else:
+        table, columns = ROLLUPS[resolution][0], "tag, ts, avg, min, max"
+    sql = (
+        f'SELECT {columns} FROM {table} WHERE board_id = (SELECT id FROM boards WHERE ip_address = ?) '
+        f'AND tag IN ({placeholders}) AND ts >= ? AND ts < ? ORDER BY tag, ts'
+    )
+    return conn.execute(sql, (ip_address, *tags, start, end)).fetchall()
+
+
+def pick_resolution(start, end):
+    """Finest resolution that keeps a range query reasonably small."""
+    span = end - start
+    if span <= 6 * 3600:
+        return RAW
+    if span <= 7 * 86400:
+        return MINUTE
+    return HOUR
+
+
+def configure(enabled=None, flush_interval=None, raw_days=None, minute_days=None, hour_days=None):
+    for key, value in (
+        ("enabled", enabled),
+        ("flush_interval", flush_interval),
+        ("raw_days", raw_days),
+        ("minute_days", minute_days),
+        ("hour_days", hour_days),
+    ):
+        if value is not None:
+            _settings[key] = value
+
+
+def get_history(ip_address):
+    history = _histories.get(ip_address)
+    if history is None:
+        history = BoardHistory(ip_address, _settings["flush_interval"])
+        _histories[ip_address] = history
+    return history
+
+
+def record(ip_address, status_record, changes):
+    if _settings["enabled"]:
+        get_history(ip_address).record(status_record, changes, time.time())
+
+
+def history_stats():
+    return [history.stats() for history in _histories.values()]
+
+
+async def close_all():
+    for history in list(_histories.values()):
+        await history.flush(final=True)
+    _histories.clear()
@@ -0,0 +1,122 @@
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Valeurs par défaut, remplacées par configure() au démarrage de l'addon
+DEFAULT_LIMIT_PER_HOST = 2
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_CONNECT_TIMEOUT = 2.0
+DEFAULT_KEEPALIVE_TIMEOUT = 30.0
+
+_settings = {
+    "limit_per_host": DEFAULT_LIMIT_PER_HOST,
+    "timeout": DEFAULT_TIMEOUT,
+    "connect_timeout": DEFAULT_CONNECT_TIMEOUT,
+    "keepalive_timeout": DEFAULT_KEEPALIVE_TIMEOUT,
+}
+_pools = {}
+
+
+class BoardHttpPool:
+    """Long-lived keep-alive HTTP session for one IPX800 board."""
+
+    def __init__(self, ip_address, limit_per_host, timeout, connect_timeout, keepalive_timeout):
+        self.ip_address = ip_address
+        self._limit_per_host = limit_per_host
+        self._timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self._keepalive_timeout = keepalive_timeout
+        self._session = None
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.requests = 0
+        self.errors = 0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self._limit_per_host,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout,
+                trace_configs=[trace_config],
+            )
+        return self._session
+
+    async def _on_connection_created(self, session, context, params):
+        self.new_connections += 1
+
+    async def _on_connection_reused(self, session, context, params):
+        self.reused_connections += 1
+
+    async def get(self, path):
+        """GET a path on the board, return (status, body)."""
+        session = self._get_session()
+        self.requests += 1
+        try:
+            async with session.get(f"http://{self.ip_address}{path}") as response:
+                return response.status, await response.text()
+        except Exception:
+            self.errors += 1
+            raise
+
+    def open_connections(self):
+        if self._session is None or self._session.closed:
+            return 0
+        connector = self._session.connector
+        # aiohttp n'expose pas ce compteur publiquement
+        acquired = len(getattr(connector, "_acquired", ()))
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return acquired + idle
+
+    def stats(self):
+        return {
+            "ip_address": self.ip_address,
+            "open": self.open_connections(),
+            "new": self.new_connections,
+            "reused": self.reused_connections,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+def configure(limit_per_host=None, timeout=None, connect_timeout=None, keepalive_timeout=None):
+    for key, value in (
+        ("limit_per_host", limit_per_host),
+        ("timeout", timeout),
+        ("connect_timeout", connect_timeout),
+        ("keepalive_timeout", keepalive_timeout),
+    ):
+        if value is not None:
+            _settings[key] = value
+
+
+def get_pool(ip_address):
+    pool = _pools.get(ip_address)
+    if pool is None:
+        pool = BoardHttpPool(ip_address, **_settings)
+        _pools[ip_address] = pool
+    return pool
+
+
+def pool_stats():
+    return [pool.stats() for pool in _pools.values()]
+
+
+async def close_all():
+    for pool in list(_pools.values()):
+        try:
+            await pool.close()
+        except Exception as e:
+            logger.error(f"Error closing HTTP session for {pool.ip_address}: {e}")
+    _pools.clear()
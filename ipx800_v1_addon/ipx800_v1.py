@@ -1,119 +1,363 @@
 import asyncio
+import os
+import signal
+import sys
+import time
 import websockets
-import sqlite3
 import json
 import logging
-import aiohttp
-import requests
-import xml.etree.ElementTree as ET
+
+import button_events
+import command_queue
+import dispatch
+import history
+import metrics
+import http_pool
+import outbound
+import poll_scheduler
+import profiling
+import protocol
+import relays
+import sharding
+import storage
+import subscriptions
+from command_queue import get_queue
+from storage import get_database, leds_to_mask, mask_to_leds
+from status_delta import get_tracker, snapshot_messages
+from status_parser import STATUS_TAGS, parse_status
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
 logger = logging.getLogger(__name__)
 
-WS_PORT = 6789
+# Surchargeables pour lancer l'addon hors de Home Assistant (benchmarks)
+WS_PORT = int(os.environ.get("IPX800_WS_PORT", 6789))
+OPTIONS_PATH = os.environ.get("IPX800_OPTIONS", "/data/options.json")
+DEFAULT_OPTIONS = {
+    "http_timeout": http_pool.DEFAULT_TIMEOUT,
+    "http_connect_timeout": http_pool.DEFAULT_CONNECT_TIMEOUT,
+    "http_limit_per_host": http_pool.DEFAULT_LIMIT_PER_HOST,
+    "http_keepalive_timeout": http_pool.DEFAULT_KEEPALIVE_TIMEOUT,
+    "db_commit_delay": storage.DEFAULT_COMMIT_DELAY,
+    "batch_led_writes": True,
+    "min_command_spacing": command_queue.DEFAULT_MIN_SPACING,
+    "poll_fast_interval": poll_scheduler.DEFAULT_FAST_INTERVAL,
+    "poll_activity_window": poll_scheduler.DEFAULT_ACTIVITY_WINDOW,
+    "poll_idle_factor": poll_scheduler.DEFAULT_IDLE_FACTOR,
+    "poll_backoff_max": poll_scheduler.DEFAULT_BACKOFF_MAX,
+    "button_burst_interval": poll_scheduler.DEFAULT_BURST_INTERVAL,
+    "button_burst_duration": poll_scheduler.DEFAULT_BURST_DURATION,
+    "button_debounce": button_events.DEFAULT_DEBOUNCE,
+    "button_counters": "",
+    "button_toggle_on": button_events.TOGGLE_ON_EDGE,
+    "client_queue_size": outbound.DEFAULT_QUEUE_SIZE,
+    "client_overflow_policy": outbound.DROP_OLDEST,
+    "client_send_timeout": outbound.DEFAULT_SEND_TIMEOUT,
+    "ws_compression": True,
+    "history_enabled": True,
+    "history_flush_interval": history.DEFAULT_FLUSH_INTERVAL,
+    "history_raw_days": history.DEFAULT_RAW_DAYS,
+    "history_minute_days": history.DEFAULT_MINUTE_DAYS,
+    "history_hour_days": history.DEFAULT_HOUR_DAYS,
+    "metrics_port": 0,
+    "profiling": False,
+    "profile_slow_callback": profiling.DEFAULT_SLOW_CALLBACK,
+    "profile_lag_interval": profiling.DEFAULT_LAG_INTERVAL,
+    "workers": 0,
+}
 clients = set()
+# Tâches des requêtes longues (profile), répondues hors de la boucle du client
+background_tasks = set()
+
+def load_options():
+    options = dict(DEFAULT_OPTIONS)
+    try:
+        with open(OPTIONS_PATH) as f:
+            options.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading {OPTIONS_PATH}: {e}")
+    return options
+
+OPTIONS = load_options()
+http_pool.configure(
+    limit_per_host=OPTIONS["http_limit_per_host"],
+    timeout=OPTIONS["http_timeout"],
+    connect_timeout=OPTIONS["http_connect_timeout"],
+    keepalive_timeout=OPTIONS["http_keepalive_timeout"],
+)
+storage.configure(commit_delay=OPTIONS["db_commit_delay"])
+relays.configure(batch=OPTIONS["batch_led_writes"])
+command_queue.configure(min_spacing=OPTIONS["min_command_spacing"])
+poll_scheduler.configure(
+    fast_interval=OPTIONS["poll_fast_interval"],
+    activity_window=OPTIONS["poll_activity_window"],
+    idle_factor=OPTIONS["poll_idle_factor"],
+    backoff_max=OPTIONS["poll_backoff_max"],
+    burst_interval=OPTIONS["button_burst_interval"],
+    burst_duration=OPTIONS["button_burst_duration"],
+)
+try:
+    button_counters = button_events.parse_counters(OPTIONS["button_counters"])
+except ValueError as e:
+    logger.error(f"Ignoring button_counters option: {e}")
+    button_counters = {}
+button_events.configure(
+    debounce=OPTIONS["button_debounce"],
+    counters=button_counters,
+    toggle_on=OPTIONS["button_toggle_on"],
+)
+outbound.configure(
+    queue_size=OPTIONS["client_queue_size"],
+    policy=OPTIONS["client_overflow_policy"],
+    send_timeout=OPTIONS["client_send_timeout"],
+)
+history.configure(
+    enabled=OPTIONS["history_enabled"],
+    flush_interval=OPTIONS["history_flush_interval"],
+    raw_days=OPTIONS["history_raw_days"],
+    minute_days=OPTIONS["history_minute_days"],
+    hour_days=OPTIONS["history_hour_days"],
+)
+# Valeurs lues au moment du scrape, à partir des statistiques existantes
+metrics.collected(
+    "ipx800_ws_clients", "Connected websocket clients", "gauge", (),
+    lambda: {(): len(clients)}
+)
+metrics.collected(
+    "ipx800_client_queue_depth", "Messages waiting in a client's outbound queue", "gauge", ("client",),
+    lambda: {(client.id,): client.stats()["queued"] for client in clients}
+)
+metrics.collected(
+    "ipx800_client_dropped_total", "Messages dropped for a slow client", "counter", ("client",),
+    lambda: {(client.id,): client.dropped for client in clients}
+)
+metrics.collected(
+    "ipx800_command_queue_depth", "LED commands waiting for their board", "gauge", ("ip_address",),
+    lambda: {(queue["ip_address"],): queue["depth"] for queue in command_queue.queue_stats()}
+)
+metrics.collected(
+    "ipx800_http_connections_total", "HTTP connections opened to a board (reconnects)", "counter", ("ip_address",),
+    lambda: {(pool["ip_address"],): pool["new"] for pool in http_pool.pool_stats()}
+)
+metrics.collected(
+    "ipx800_poll_consecutive_failures", "Failed polls in a row for a board", "gauge", ("ip_address",),
+    lambda: {(poller["ip_address"],): poller["failures"] for poller in poll_scheduler.poller_stats()}
+)
 
 async def register(websocket):
-    clients.add(websocket)
+    # Toutes les émissions vers ce client passent par sa file bornée
+    client = outbound.create_writer(websocket)
+    clients.add(client)
+    metrics.WS_CONNECTIONS.inc()
+    if sharding.enabled():
+        sharding.add_client(client)
     try:
         async for message in websocket:
-            await handle_message(websocket, message)
+            await handle_message(client, message)
     finally:
-        clients.remove(websocket)
+        clients.remove(client)
+        client.close()
+        if sharding.enabled():
+            sharding.remove_client(client)
+        forget_client(client)
+
+def forget_client(client):
+    subscriptions.unsubscribe(client)
+    poll_scheduler.unsubscribe_all(client)
 
 async def handle_message(websocket, message):
+    start = time.perf_counter()
     data = json.loads(message)
-    action = data.get("action")
-    logger.info(f"action:{action}")
-    logger.info(f"data:{data}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"action:{data.get('action')} data:{data}")
+
+    if sharding.enabled() and (data.get("ip_address") or "worker" in data):
+        # Mode multi-process : le worker de la carte (ou "worker": index pour
+        # get_loop_stats et profile) répond lui-même au client
+        response = None
+        if not sharding.route(websocket, data) and "id" in data:
+            response = {"action": "error", "error": "No such worker or worker restarting", "id": data["id"]}
+    elif sharding.enabled() and data.get("action") in sharding.GATHER_ACTIONS:
+        response = await sharding.gather(websocket, data)
+    else:
+        response = await process_request(websocket, data)
+    if response is not None:
+        await websocket.send(json.dumps(response))
+    metrics.WS_REQUEST_SECONDS.observe(time.perf_counter() - start)
 
+async def process_request(websocket, data):
+    """Run one request and return the reply owed to the client, if any."""
+    action = data.get("action")
+    # Réponse directe à la requête ; avec un "id", elle est toujours envoyée
+    response = None
     try:
-        if action == "init_device":
-            await init_device(data)
+        if action == "hello":
+            websocket.protocol = protocol.negotiate(data.get("protocols"))
+            response = {"action": "hello", "protocol": websocket.protocol}
+        elif action == "init_device":
+            await init_device(websocket, data)
         elif action == "set_led_state":
-            await set_led_state(data)
+            result = await set_led_state(data)
+            response = {"action": "set_led_state_result", **result}
         elif action == "get_data":
-            await get_data(websocket, data)
+            response = await get_data(data)
         elif action == "add_device":
-            await add_device(data)
+            response = await add_device(data)
+        elif action == "subscribe":
+            await subscribe(websocket, data)
+        elif action == "unsubscribe":
+            subscriptions.unsubscribe(websocket, data["ip_address"])
+            poll_scheduler.unsubscribe(data["ip_address"], websocket)
+        elif action == "resync":
+            await send_snapshots(websocket, data.get("ip_address"))
+        elif action == "get_pool_stats":
+            response = {"action": "pool_stats", "pools": http_pool.pool_stats()}
+        elif action == "get_poll_stats":
+            response = {"action": "poll_stats", "pollers": poll_scheduler.poller_stats()}
+        elif action == "get_client_stats":
+            response = {"action": "client_stats", "clients": [c.stats() for c in clients]}
+        elif action == "get_queue_stats":
+            response = {"action": "queue_stats", "queues": command_queue.queue_stats()}
+        elif action == "get_button_stats":
+            response = {"action": "button_stats", "buttons": button_events.detector_stats()}
+        elif action == "get_history":
+            response = await get_history(data)
+        elif action == "get_history_stats":
+            response = {"action": "history_stats", "histories": history.history_stats()}
+        elif action == "get_loop_stats":
+            response = {"action": "loop_stats", "loop": profiling.loop_stats()}
+        elif action == "profile":
+            # Jusqu'à 60 s : les autres requêtes du client ne doivent pas attendre
+            task = asyncio.get_running_loop().create_task(send_profile(websocket, data))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+            return None
+        elif action == "get_metrics":
+            response = {"action": "metrics", "samples": metrics.collect()}
+        elif action == "get_worker_stats":
+            response = {"action": "worker_stats", "workers": sharding.worker_stats()}
         else:
             logger.warning(f"Unknown action: {action}")
+            response = {"action": "error", "error": f"Unknown action: {action}"} if "id" in data else None
     except Exception as e:
         logger.error(f"Error handling message: {e}")
+        metrics.WS_ERRORS.inc()
+        response = {"action": "error", "error": str(e)} if "id" in data else None
+
+    if response is None and "id" in data:
+        response = {"action": "ack"}
+    if response is not None and "id" in data:
+        response["id"] = data["id"]
+    return response
+
+async def send_profile(websocket, data):
+    try:
+        result = await profiling.profile(data.get("seconds", 5), data.get("top", 30), data.get("sort", "cumulative"))
+        response = {"action": "profile_result", **result}
+    except Exception as e:
+        logger.error(f"Error profiling: {e}")
+        metrics.WS_ERRORS.inc()
+        if "id" not in data:
+            return
+        response = {"action": "error", "error": str(e)}
+    if "id" in data:
+        response["id"] = data["id"]
+    await websocket.send(json.dumps(response))
 
-async def init_device(data):
+async def init_device(websocket, data):
     device_name = data["device_name"]
     ip_address = data["ip_address"]
     poll_interval = data["poll_interval"]
     unique_id = data["unique_id"]
 
-    db_path = f"/config/ipx800_{ip_address}.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS infos (
-            device_name TEXT,
-            ip_address TEXT,
-            poll_interval INTEGER,
-            unique_id TEXT
-        )
-    ''')
-    cursor.execute('SELECT COUNT(*) FROM infos WHERE device_name = ? AND ip_address = ?', (device_name, ip_address))
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('''
-            INSERT INTO infos (device_name, ip_address, poll_interval, unique_id)
-            VALUES (?, ?, ?, ?)
-        ''', (device_name, ip_address, poll_interval, unique_id))
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            device_name TEXT,
-            input_button TEXT,
-            select_leds TEXT,
-            unique_id TEXT,
-            variable_etat_name TEXT,
-            ip_address TEXT,
-            state TEXT DEFAULT 'off'
-        )
-    ''')
-
-    # Ajouter la colonne ip_address si elle n'existe pas
-    cursor.execute("PRAGMA table_info(devices)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'ip_address' not in columns:
-        cursor.execute('ALTER TABLE devices ADD COLUMN ip_address TEXT')
-    if 'state' not in columns:
-        cursor.execute("ALTER TABLE devices ADD COLUMN state TEXT DEFAULT 'off'")
-
-    conn.commit()
-    conn.close()
-
-    asyncio.create_task(poll_ipx800(ip_address, poll_interval))
+    db = get_database()
+    await db.run(register_board, device_name, ip_address, poll_interval, unique_id, commit=True)
+    # Carte visible par Home Assistant dès la réponse
+    await db.flush()
+    if not dispatch.is_loaded(ip_address):
+        await load_dispatch(ip_address)
+
+    # Un seul poller par carte, partagé par tous les clients abonnés
+    subscriptions.subscribe(websocket, ip_address)
+    poll_scheduler.subscribe(ip_address, websocket, poll_interval, poll_ipx800)
+    # Le nouvel abonné reçoit tout de suite le dernier état connu
+    await send_snapshots(websocket, ip_address)
+
+async def subscribe(websocket, data):
+    ip_address = data["ip_address"]
+    channels = data.get("channels")
+    if channels is not None:
+        unknown = set(channels) - set(subscriptions.CHANNELS)
+        if unknown:
+            logger.warning(f"Ignoring unknown channels {sorted(unknown)}")
+        channels = [channel for channel in channels if channel in subscriptions.CHANNELS]
+    subscriptions.subscribe(websocket, ip_address, channels)
+    # Avec poll_interval, l'abonné maintient aussi le polling de la carte
+    if "poll_interval" in data:
+        poll_scheduler.subscribe(ip_address, websocket, data["poll_interval"], poll_ipx800)
+    await send_snapshots(websocket, ip_address)
+
+async def send_snapshots(websocket, ip_address=None):
+    for snapshot in snapshot_messages(ip_address):
+        channels = subscriptions.subscribers(snapshot["ip_address"]).get(websocket)
+        snapshot["status"] = subscriptions.filter_status(snapshot["status"], channels)
+        snapshot["seq"] = get_tracker(snapshot["ip_address"]).channel_seq(channels)
+        await websocket.send(protocol.encode_status(snapshot, websocket.protocol))
+
+def register_board(conn, device_name, ip_address, poll_interval, unique_id):
+    # Le schéma est créé et mis à jour par storage.migrate()
+    conn.execute('''
+        INSERT INTO boards (device_name, ip_address, poll_interval, unique_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (ip_address) DO UPDATE SET
+            device_name = excluded.device_name,
+            poll_interval = excluded.poll_interval,
+            unique_id = excluded.unique_id
+    ''', (device_name, ip_address, poll_interval, unique_id))
+
+def insert_device(conn, ip_address, device_name, input_button, led_mask, unique_id, variable_etat_name):
+    return conn.execute('''
+        INSERT OR IGNORE INTO devices
+            (board_id, device_name, input_button, led_mask, unique_id, variable_etat_name, state)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        storage.board_id(conn, ip_address), device_name, input_button, led_mask,
+        unique_id, variable_etat_name, 'off'
+    )).rowcount
 
 async def add_device(data):
     device_name = data["device_name"]
     input_button = data["input_button"]
     select_leds = ",".join(data["select_leds"])
+    led_mask = leds_to_mask(data["select_leds"])
     unique_id = data["unique_id"]
     variable_etat_name = data["variable_etat_name"]
     ip_address = data["ip_address"]
 
-    db_path = f"/config/ipx800_{ip_address}.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT COUNT(*) FROM devices WHERE device_name = ? AND ip_address = ?
-    ''', (device_name, ip_address))
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('''
-            INSERT INTO devices (device_name, input_button, select_leds, unique_id, variable_etat_name, ip_address, state)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (device_name, input_button, select_leds, unique_id, variable_etat_name, ip_address, 'off'))
-        conn.commit()
-    conn.close()
-    logger.info(f"Device {device_name} added with leds {select_leds} and variable {variable_etat_name}.")
-    
+    db = get_database()
+    added = await db.run(
+        insert_device, ip_address, device_name, input_button, led_mask, unique_id, variable_etat_name,
+        commit=True
+    )
+    if added:
+        # Home Assistant relit la base dès la réponse : l'appareil doit y être
+        await db.flush()
+        logger.info(f"Device {device_name} added with leds {select_leds} and variable {variable_etat_name}.")
+        # La configuration a changé : reconstruire la table de dispatch de la carte
+        await load_dispatch(ip_address)
+    return {"action": "add_device_result", "ip_address": ip_address, "device_name": device_name, "added": bool(added)}
+
+async def load_dispatch(ip_address):
+    rows = await get_database().fetchall('''
+        SELECT device_name, input_button, led_mask, state FROM devices
+        WHERE board_id = (SELECT id FROM boards WHERE ip_address = ?) ORDER BY id
+    ''', (ip_address,))
+    dispatch.set_board(ip_address, [
+        dispatch.DeviceEntry(device_name, input_button, led_mask, f"light.{clean_entity_name(device_name)}", state)
+        for device_name, input_button, led_mask, state in rows
+    ])
+
 
 async def set_led_state(data):
     state = data["state"]
@@ -122,131 +366,285 @@ async def set_led_state(data):
     variable_etat_name = data["variable_etat_name"]
     device_name = data.get("device_name", None)
 
-    # Implémenter la logique pour allumer ou éteindre les LED de l'IPX800
-    logger.info(f"Setting LED state to {'on' if state else 'off'} for LEDs: {select_leds}")
+    # Toutes les LED de l'appareil en une seule écriture sur la carte
+    result = await get_queue(ip_address).submit({led: state for led in select_leds})
+    result["device_name"] = device_name
+    # Relire la carte rapidement pour confirmer l'écriture
+    poll_scheduler.mark_activity(ip_address)
+    logger.debug(
+        f"Set LEDs {select_leds} to {'on' if state else 'off'} on {ip_address}: "
+        f"{'ok' if result['ok'] else 'failed'} in {result['requests']} request(s)"
+    )
     try:
-        async with aiohttp.ClientSession() as session:
-            for led in select_leds:
-                url = f"http://{ip_address}/preset.htm?{led}={'1' if state else '0'}"
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        logger.error(f"Error setting LED {led} to state {'1' if state else '0'}: {response.status}")
-                    else:
-                        logger.info(f"Set LED {led} to state {'1' if state else '0'}")
-
         if device_name:
+            entry = dispatch.get_device(ip_address, device_name)
+            if entry is not None:
+                entry.state = 'on' if state else 'off'
             # Mettre à jour l'état dans la base de données
-            db_path = f"/config/ipx800_{ip_address}.db"
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute(f"UPDATE devices SET state = ? WHERE device_name = ?", ('on' if state else 'off', device_name))
-            conn.commit()
-            conn.close()
+            await get_database().write(
+                "UPDATE devices SET state = ? WHERE board_id = (SELECT id FROM boards WHERE ip_address = ?) "
+                "AND device_name = ?", ('on' if state else 'off', ip_address, device_name)
+            )
     except Exception as e:
         logger.error(f"Error setting LED state: {e}")
+    return result
 
-async def get_data(websocket, data):
+async def get_data(data):
     ip_address = data.get("ip_address")
     if not ip_address:
-        return
-    db_path = f"/config/ipx800_{ip_address}.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM devices')
-    rows = cursor.fetchall()
+        return None
+    rows = await get_database().fetchall('''
+        SELECT d.device_name, d.input_button, d.led_mask, d.unique_id, d.variable_etat_name, b.ip_address, d.state
+        FROM devices d JOIN boards b ON b.id = d.board_id
+        WHERE b.ip_address = ? ORDER BY d.id
+    ''', (ip_address,))
     devices = []
     for row in rows:
         devices.append({
             "device_name": row[0],
             "input_button": row[1],
-            "select_leds": row[2].split(","),
+            "select_leds": list(mask_to_leds(row[2])),
             "unique_id": row[3],
             "variable_etat_name": row[4],
             "ip_address": row[5],
             "state": row[6]
         })
-    await websocket.send(json.dumps({"action": "data", "devices": devices}))
-    conn.close()
+    return {"action": "data", "ip_address": ip_address, "devices": devices}
 
-async def poll_ipx800(ip_address, interval):
-    previous_status = {}
-    while True:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f'http://{ip_address}/status.xml') as response:
-                    response_text = await response.text()
-                    await process_status(response_text, ip_address, previous_status)
-        except Exception as e:
-            logger.error(f"Error polling IPX800: {e}")
-        await asyncio.sleep(interval)
-
-async def process_status(xml_data, ip_address, previous_status):
-    root = ET.fromstring(xml_data)
-    status = {child.tag: child.text for child in root}
-
-    logger.info(f"Status: {status}")
-    
-    # Vérifier les changements d'état des boutons
-    for btn in ['btn0', 'btn1', 'btn2', 'btn3']:
-        if btn in status and previous_status.get(btn) != status[btn]:
-            await handle_button_change(ip_address, btn, status[btn])
-
-    previous_status.update(status)
-
-    # Notify all connected clients with the new status
-    message = json.dumps({"action": "status_update", "status": status})
-    await notify_clients(message)
+async def get_history(data):
+    ip_address = data["ip_address"]
+    end = float(data.get("end") or time.time())
+    start = float(data.get("start") or end - 3600)
+    tags = data.get("tags") or list(STATUS_TAGS)
+    unknown = [tag for tag in tags if tag not in STATUS_TAGS]
+    if unknown:
+        raise ValueError(f"Unknown tags: {unknown}")
+    resolution = data.get("resolution") or history.pick_resolution(start, end)
+    if resolution not in history.RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    series = await history.get_history(ip_address).query(tags, start, end, resolution)
+    return {
+        "action": "history",
+        "ip_address": ip_address,
+        "start": start,
+        "end": end,
+        "resolution": resolution,
+        "series": series
+    }
+
+async def poll_ipx800(ip_address):
+    """Poll status.xml once, return True when a relay or a button changed."""
+    start = time.perf_counter()
+    try:
+        _, response_text = await http_pool.get_pool(ip_address).get('/status.xml')
+    except Exception:
+        metrics.POLL_ERRORS.inc(ip_address)
+        raise
+    metrics.POLL_SECONDS.observe(time.perf_counter() - start, ip_address)
+    changes = await process_status(response_text, ip_address, get_tracker(ip_address))
+    return poll_scheduler.is_activity(changes)
+
+async def process_status(xml_data, ip_address, tracker):
+    start = time.perf_counter()
+    record = parse_status(xml_data)
+    metrics.PARSE_SECONDS.observe(time.perf_counter() - start)
+    changes = tracker.update_record(record)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Status {ip_address}: {record.as_dict()}")
+    history.record(ip_address, record, changes)
+
+    # Fronts des boutons : comparés à l'état accepté, pas seulement au poll précédent
+    events = button_events.get_detector(ip_address).update(record, asyncio.get_running_loop().time())
+    for event in events:
+        await handle_button_event(ip_address, event)
+    if not changes:
+        return changes
+
+    # Notify the board's subscribers with the changed tags only
+    await publish_delta(tracker, changes)
+    return changes
+
+async def handle_button_event(ip_address, event):
+    logger.info(
+        f"Button {event.button} on {ip_address} is {event.state}: "
+        f"{event.edges} edge(s), {event.presses} press(es)"
+    )
+    # Un appui en annonce souvent d'autres : polling rapproché pendant un moment
+    poll_scheduler.burst(ip_address)
+    await notify_board(ip_address, "btn", json.dumps(event.as_message(ip_address)))
+    # Un nombre pair de bascules ramène les lumières à leur état
+    if event.toggles % 2:
+        await handle_button_change(ip_address, event.button, event.state)
 
 async def handle_button_change(ip_address, btn, state):
-    logger.info(f"Button {btn} changed state to {state}")
-    db_path = f"/config/ipx800_{ip_address}.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT device_name, select_leds, state FROM devices WHERE input_button = ?', (btn,))
-    rows = cursor.fetchall()
+    if not dispatch.is_loaded(ip_address):
+        await load_dispatch(ip_address)
+    entries = dispatch.devices_for_button(ip_address, btn)
+    if not entries:
+        return
 
-    for row in rows:
-        device_name, select_leds, current_state = row
-        new_state = 'off' if current_state == 'on' else 'on'
-        leds = select_leds.split(',')
-        await set_led_state({
-            "state": new_state == 'on',
-            "leds": leds,
-            "ip_address": ip_address,
-            "variable_etat_name": f'etat_{clean_entity_name(device_name)}',
-            "device_name": device_name
-        })
-        
-        # Mettre à jour l'état dans la base de données
-        cursor.execute(f"UPDATE devices SET state = ? WHERE device_name = ?", (new_state, device_name))
-        conn.commit()
-        
-        # Mettre à jour l'état dans Home Assistant
-        await notify_clients(json.dumps({
+    # Les LED de tous les appareils du bouton partent en une seule écriture
+    new_states = []
+    leds = {}
+    for entry in entries:
+        new_state = 'off' if entry.state == 'on' else 'on'
+        new_states.append((entry, new_state))
+        for led in entry.leds:
+            leds[led] = new_state == 'on'
+    result = await get_queue(ip_address).submit(leds)
+    poll_scheduler.mark_activity(ip_address)
+    if not result["ok"]:
+        logger.error(f"Button {btn} on {ip_address}: LED write failed {result['leds']}")
+        # Seuls les appareils dont toutes les LED ont changé changent d'état
+        new_states = [
+            (entry, new_state) for entry, new_state in new_states
+            if all(result["leds"].get(led) for led in entry.leds)
+        ]
+        if not new_states:
+            return
+
+    # Mettre à jour l'état dans la base de données
+    for entry, new_state in new_states:
+        entry.state = new_state
+    await get_database().write_many(
+        "UPDATE devices SET state = ? WHERE board_id = (SELECT id FROM boards WHERE ip_address = ?) "
+        "AND device_name = ?",
+        [(new_state, ip_address, entry.device_name) for entry, new_state in new_states]
+    )
+
+    # Mettre à jour l'état dans Home Assistant
+    for entry, new_state in new_states:
+        await notify_board(ip_address, "entity", json.dumps({
             "action": "update_entity_state",
-            "entity_id": f"light.{clean_entity_name(device_name)}",
+            "ip_address": ip_address,
+            "entity_id": entry.entity_id,
             "state": new_state
         }))
 
-    conn.close()
+async def publish_delta(tracker, changes):
+    start = time.perf_counter()
+    # Une seule sérialisation par couple (canaux, protocole) distinct, et un
+    # numéro de séquence par jeu de canaux : pas de trou pour un abonné filtré
+    payloads = {}
+    seqs = {}
+    messages = []
+    for client, channels in subscriptions.subscribers(tracker.ip_address).items():
+        key = (channels, client.protocol)
+        if key not in payloads:
+            filtered = subscriptions.filter_status(changes, channels)
+            if filtered and channels not in seqs:
+                seqs[channels] = tracker.next_channel_seq(channels)
+            payloads[key] = protocol.encode_status(
+                tracker.delta_message(filtered, seqs[channels]), client.protocol
+            ) if filtered else None
+        if payloads[key] is not None:
+            messages.append((client, payloads[key]))
+    await notify_clients(messages)
+    metrics.BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+async def notify_board(ip_address, channel, message):
+    await notify_clients([(client, message) for client in subscriptions.subscribers(ip_address, channel)])
 
-async def notify_clients(message):
-    if clients:
-        await asyncio.gather(*(client.send(message) for client in clients))
+async def notify_clients(messages):
+    # Jamais bloquant : chaque client a sa propre file et sa tâche d'envoi
+    for client, message in messages:
+        client.send_nowait(message)
+    metrics.BROADCAST_MESSAGES.inc(amount=len(messages))
+
+def profiling_requested(loop):
+    # Mode profilage : option, IPX800_PROFILE=1 ou mode debug d'asyncio (PYTHONASYNCIODEBUG)
+    env = os.environ.get("IPX800_PROFILE", "").strip().lower()
+    return OPTIONS["profiling"] or env in ("1", "true", "yes", "on") or loop.get_debug()
 
 async def main():
-    while True:
-        try:
-            async with websockets.serve(register, "0.0.0.0", WS_PORT):
-                logger.info(f"WebSocket server started on ws://0.0.0.0:{WS_PORT}")
-                await asyncio.Future()  # run forever
-        except Exception as e:
-            logger.error(f"WebSocket server error: {e}")
-            await asyncio.sleep(5)  # wait before retrying
+    # Arrêt propre sur SIGTERM (docker stop)
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    if OPTIONS["metrics_port"]:
+        await metrics.start_server(OPTIONS["metrics_port"], collect=collect_worker_metrics)
+    loop = asyncio.get_running_loop()
+    if profiling_requested(loop):
+        profiling.start(loop, OPTIONS["profile_slow_callback"], OPTIONS["profile_lag_interval"])
+    try:
+        # Home Assistant lit la base avant d'envoyer init_device : elle doit
+        # exister, migrée et importée, dès le démarrage
+        await get_database().open()
+        if OPTIONS["workers"] > 0:
+            # Les cartes sont réparties sur les workers, ce process ne garde que le websocket
+            await sharding.start_workers(
+                OPTIONS["workers"], [sys.executable, os.path.abspath(__file__), "--worker"], on_worker_restart
+            )
+        while True:
+            try:
+                compression = "deflate" if OPTIONS["ws_compression"] else None
+                async with websockets.serve(register, "0.0.0.0", WS_PORT, compression=compression):
+                    logger.info(f"WebSocket server started on ws://0.0.0.0:{WS_PORT}")
+                    await asyncio.Future()  # run forever
+            except Exception as e:
+                logger.error(f"WebSocket server error: {e}")
+                await asyncio.sleep(5)  # wait before retrying
+    finally:
+        await sharding.stop_workers()
+        poll_scheduler.stop_all()
+        command_queue.stop_all()
+        profiling.stop()
+        await metrics.stop_server()
+        await http_pool.close_all()
+        await history.close_all()
+        await storage.close()
+
+async def collect_worker_metrics():
+    # Les polls, la base et les relais sont mesurés dans les workers
+    if not sharding.enabled():
+        return []
+    try:
+        responses = await sharding.collect({"action": "get_metrics"})
+    except asyncio.TimeoutError:
+        logger.error("Timeout collecting metrics from the board workers")
+        return []
+    return [(index, response["samples"]) for index, response in sorted(responses.items()) if response]
+
+def on_worker_restart(index):
+    # Abonnements perdus : les clients se reconnectent et refont init_device
+    for client in list(clients):
+        asyncio.get_running_loop().create_task(client.websocket.close())
+
+async def worker_main(index):
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f'%(asctime)s %(levelname)s:worker {index}:%(message)s'))
+    # Tous les workers écrivent dans la même base : une transaction gardée
+    # ouverte db_commit_delay bloquerait les autres pendant ce délai
+    storage.configure(commit_delay=0)
+    # Métriques relevées par le front end à chaque scrape (get_metrics)
+    metrics.configure(enabled=bool(OPTIONS["metrics_port"]))
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+    if profiling_requested(loop):
+        profiling.start(loop, OPTIONS["profile_slow_callback"], OPTIONS["profile_lag_interval"])
+    try:
+        await get_database().open()
+        await sharding.run_worker(index, process_request, forget_client)
+    finally:
+        poll_scheduler.stop_all()
+        command_queue.stop_all()
+        profiling.stop()
+        await http_pool.close_all()
+        await history.close_all()
+        await storage.close()
 
 def clean_entity_name(name):
     return name.lower().replace(' ', '_').replace('é', 'e').replace('è', 'e').replace('ê', 'e').replace('à', 'a').replace('ç', 'c')
 
 if __name__ == "__main__":
-    logger.info(f"Starting WebSocket server on ws://0.0.0.0:{WS_PORT}")
-    asyncio.run(main())
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        try:
+            asyncio.run(worker_main(int(sys.argv[2])))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+    else:
+        logger.info(f"Starting WebSocket server on ws://0.0.0.0:{WS_PORT}")
+        try:
+            asyncio.run(main())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            logger.info("WebSocket server stopped")
@@ -0,0 +1,205 @@
+import bisect
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Bornes des histogrammes en secondes, de la milliseconde à la dizaine de secondes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_settings = {"enabled": False, "collect": None}
+_metrics = []
+_runner = None
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _add_label(labels, pair):
+    return "{" + pair + "}" if not labels else labels[:-1] + "," + pair + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one value per label combination."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        if _settings["enabled"]:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label_values -> [comptes par borne (+ dépassement), somme, nombre]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        if not _settings["enabled"]:
+            return
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for label_values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, label_values, le), cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Collected:
+    """Gauge or counter read at scrape time from existing stats: func() -> {label_values: value}."""
+
+    def __init__(self, name, help, type, labels, func):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self._func = func
+
+    def samples(self):
+        try:
+            values = self._func()
+        except Exception as e:
+            logger.error(f"Error collecting metric {self.name}: {e}")
+            return
+        for label_values, value in values.items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+def counter(name, help, labels=()):
+    metric = Counter(name, help, labels)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help, labels, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def collected(name, help, type, labels, func):
+    metric = Collected(name, help, type, labels, func)
+    _metrics.append(metric)
+    return metric
+
+
+def collect():
+    """Samples of this process by metric name, to be rendered by another one."""
+    return {metric.name: [list(sample) for sample in metric.samples()] for metric in _metrics}
+
+
+def render(workers=()):
+    """All metrics in the Prometheus text exposition format.
+
+    workers is a list of (worker index, collect() of that worker); their
+    samples are added to this process's with a worker label.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        for index, samples in workers:
+            worker = f'worker="{index}"'
+            for name, labels, value in samples.get(metric.name, ()):
+                lines.append(f"{name}{_add_label(labels, worker)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def enabled():
+    return _settings["enabled"]
+
+
+def configure(enabled=None):
+    if enabled is not None:
+        _settings["enabled"] = enabled
+
+
+async def _handle_metrics(request):
+    workers = await _settings["collect"]() if _settings["collect"] is not None else ()
+    return web.Response(text=render(workers), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(port, host="0.0.0.0", collect=None):
+    """Serve /metrics on its own port; recording starts with the server.
+
+    collect() is awaited on each scrape and returns the worker samples
+    passed to render().
+    """
+    global _runner
+    _settings["enabled"] = True
+    _settings["collect"] = collect
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logger.info(f"Metrics served on http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+
+
+# Métriques de l'addon, partagées par tous les modules
+POLL_SECONDS = histogram("ipx800_poll_seconds", "status.xml round trip", ("ip_address",))
+POLL_ERRORS = counter("ipx800_poll_errors_total", "Failed status.xml polls", ("ip_address",))
+PARSE_SECONDS = histogram("ipx800_parse_seconds", "status.xml parsing time")
+DB_SECONDS = histogram("ipx800_db_seconds", "Database call time, storage thread queueing included", ("operation",))
+DB_ERRORS = counter("ipx800_db_errors_total", "Failed database calls", ("operation",))
+RELAY_WRITE_SECONDS = histogram("ipx800_relay_write_seconds", "LED write time, all requests included", ("ip_address",))
+RELAY_REQUESTS = counter("ipx800_relay_requests_total", "preset.htm requests sent", ("ip_address",))
+RELAY_ERRORS = counter("ipx800_relay_errors_total", "LED writes that failed", ("ip_address",))
+BROADCAST_SECONDS = histogram("ipx800_broadcast_seconds", "Time to encode and queue one broadcast to all subscribers")
+BROADCAST_MESSAGES = counter("ipx800_broadcast_messages_total", "Messages queued to websocket clients")
+WS_CONNECTIONS = counter("ipx800_ws_connections_total", "Websocket connections accepted")
+WS_REQUEST_SECONDS = histogram("ipx800_ws_request_seconds", "Websocket request handling time")
+WS_ERRORS = counter("ipx800_ws_errors_total", "Websocket requests that failed")
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_SEND_TIMEOUT = 10.0
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+_settings = {
+    "queue_size": DEFAULT_QUEUE_SIZE,
+    "policy": DROP_OLDEST,
+    "send_timeout": DEFAULT_SEND_TIMEOUT,
+}
+_next_id = 0
+
+
+class ClientWriter:
+    """Bounded outbound queue and writer task for one websocket client.
+
+    send() never waits on the network, so polling and relay control are not
+    held back by a slow consumer. When the queue is full the oldest message
+    is dropped, or the client is disconnected, depending on `policy`.
+    """
+
+    def __init__(self, websocket, queue_size, policy, send_timeout):
+        global _next_id
+        _next_id += 1
+        self.id = _next_id
+        self.websocket = websocket
+        # Protocole négocié par "hello" pour les messages de statut
+        self.protocol = "json"
+        self._queue_size = queue_size
+        self._policy = policy
+        self._send_timeout = send_timeout
+        self._queue = collections.deque()
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.max_lag = 0.0
+
+    def send_nowait(self, message):
+        if self.closed:
+            return False
+        if len(self._queue) >= self._queue_size:
+            if self._policy == DISCONNECT:
+                logger.warning(f"Client {self.id} is too slow ({len(self._queue)} queued), disconnecting")
+                self._disconnect()
+                return False
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append((asyncio.get_running_loop().time(), message))
+        self._ready.set()
+        return True
+
+    async def send(self, message):
+        # Même interface que le websocket pour les réponses aux actions
+        self.send_nowait(message)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                while not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                enqueued, message = self._queue.popleft()
+                try:
+                    await asyncio.wait_for(self.websocket.send(message), self._send_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Client {self.id} stalled for {self._send_timeout}s, disconnecting")
+                    self._disconnect()
+                    return
+                except Exception as e:
+                    logger.info(f"Client {self.id} send failed, closing its writer: {e}")
+                    self.closed = True
+                    return
+                self.sent += 1
+                self.max_lag = max(self.max_lag, loop.time() - enqueued)
+        except asyncio.CancelledError:
+            pass
+
+    def _disconnect(self):
+        self.closed = True
+        self._queue.clear()
+        asyncio.get_running_loop().create_task(self.websocket.close())
+
+    def lag(self):
+        """Age in seconds of the oldest message still waiting to be sent."""
+        if not self._queue:
+            return 0.0
+        return asyncio.get_running_loop().time() - self._queue[0][0]
+
+    def stats(self):
+        remote_address = getattr(self.websocket, "remote_address", None)
+        return {
+            "id": self.id,
+            "remote_address": str(remote_address) if remote_address else None,
+            "protocol": self.protocol,
+            "queued": len(self._queue),
+            "lag": round(self.lag(), 3),
+            "max_lag": round(self.max_lag, 3),
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+    def close(self):
+        self.closed = True
+        self._task.cancel()
+
+
+def configure(queue_size=None, policy=None, send_timeout=None):
+    if queue_size is not None:
+        _settings["queue_size"] = queue_size
+    if policy is not None:
+        _settings["policy"] = policy
+    if send_timeout is not None:
+        _settings["send_timeout"] = send_timeout
+
+
+def create_writer(websocket):
+    return ClientWriter(websocket, **_settings)
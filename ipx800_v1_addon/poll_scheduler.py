@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAST_INTERVAL = 0.5
+DEFAULT_ACTIVITY_WINDOW = 10.0
+# Les boutons muraux ne sont vus que par le polling : par défaut, jamais
+# plus lent que l'intervalle configuré
+DEFAULT_IDLE_FACTOR = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+DEFAULT_BURST_INTERVAL = 0.1
+DEFAULT_BURST_DURATION = 2.0
+IDLE_GROWTH = 1.5
+# Seuls les relais et les boutons comptent comme activité : le bruit des
+# entrées analogiques et les compteurs ne doivent pas garder le poll rapide
+ACTIVITY_PREFIXES = ("led", "btn")
+
+_settings = {
+    "fast_interval": DEFAULT_FAST_INTERVAL,
+    "activity_window": DEFAULT_ACTIVITY_WINDOW,
+    "idle_factor": DEFAULT_IDLE_FACTOR,
+    "backoff_max": DEFAULT_BACKOFF_MAX,
+    "burst_interval": DEFAULT_BURST_INTERVAL,
+    "burst_duration": DEFAULT_BURST_DURATION,
+}
+_pollers = {}
+
+
+class BoardPoller:
+    """Single polling task for one board with an adaptive interval.
+
+    - right after a button edge the board is polled every `burst_interval`
+      for `burst_duration` seconds, to catch the rest of the press;
+    - right after activity (a led/btn change or a relay write) the board is
+      polled every `fast_interval` for `activity_window` seconds;
+    - while nothing changes the interval grows from the configured one up
+      to `idle_factor` times it (1 by default: no slower than configured);
+    - an unreachable board is retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, ip_address, interval, poll_once, fast_interval, activity_window, idle_factor, backoff_max,
+                 burst_interval, burst_duration):
+        self.ip_address = ip_address
+        self._poll_once = poll_once
+        self._fast_interval = fast_interval
+        self._activity_window = activity_window
+        self._idle_factor = idle_factor
+        self._backoff_max = backoff_max
+        self._burst_interval = burst_interval
+        self._burst_duration = burst_duration
+        self.set_interval(interval)
+        self._active_until = 0.0
+        self._burst_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # abonné -> intervalle demandé
+        self.subscribers = {}
+        self.failures = 0
+        self.polls = 0
+        self.bursts = 0
+
+    def set_interval(self, interval):
+        self.base_interval = float(interval)
+        self.interval = self.base_interval
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def mark_activity(self):
+        loop = asyncio.get_running_loop()
+        self._active_until = loop.time() + self._activity_window
+        self._wakeup.set()
+
+    def burst(self):
+        if self._burst_duration <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if loop.time() >= self._burst_until:
+            self.bursts += 1
+        self._burst_until = loop.time() + self._burst_duration
+        self._active_until = max(self._active_until, self._burst_until + self._activity_window)
+        self._wakeup.set()
+
+    def _next_delay(self, changed):
+        loop = asyncio.get_running_loop()
+        if changed:
+            self._active_until = loop.time() + self._activity_window
+            self.interval = self.base_interval
+        if loop.time() < self._burst_until:
+            return min(self._burst_interval, self.base_interval)
+        if loop.time() < self._active_until:
+            return min(self._fast_interval, self.base_interval)
+        delay = self.interval
+        self.interval = min(self.interval * IDLE_GROWTH, self.base_interval * self._idle_factor)
+        return delay
+
+    def _backoff_delay(self):
+        delay = min(self._backoff_max, self.base_interval * 2 ** self.failures)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _run(self):
+        while True:
+            self.polls += 1
+            try:
+                changed = await self._poll_once(self.ip_address)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                delay = self._backoff_delay()
+                logger.error(f"Error polling IPX800 {self.ip_address} (retry in {delay:.1f}s): {e}")
+            else:
+                self.failures = 0
+                delay = self._next_delay(changed)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return {
+            "ip_address": self.ip_address,
+            "base_interval": self.base_interval,
+            "interval": self.interval,
+            "failures": self.failures,
+            "polls": self.polls,
+            "bursts": self.bursts,
+            "subscribers": len(self.subscribers),
+        }
+
+
+def is_activity(changes):
+    """True when a status delta holds a relay or button change."""
+    return any(tag.startswith(ACTIVITY_PREFIXES) for tag in changes)
+
+
+def configure(fast_interval=None, activity_window=None, idle_factor=None, backoff_max=None,
+              burst_interval=None, burst_duration=None):
+    for key, value in (
+        ("fast_interval", fast_interval),
+        ("activity_window", activity_window),
+        ("idle_factor", idle_factor),
+        ("backoff_max", backoff_max),
+        ("burst_interval", burst_interval),
+        ("burst_duration", burst_duration),
+    ):
+        if value is not None:
+            _settings[key] = value
+
+
+def subscribe(ip_address, subscriber, interval, poll_once):
+    """Register a subscriber of a board, starting its poller if needed.
+
+    Every subscriber of a board shares the same poller; the fastest
+    requested interval wins.
+    """
+    poller = _pollers.get(ip_address)
+    if poller is None:
+        poller = BoardPoller(ip_address, interval, poll_once, **_settings)
+        _pollers[ip_address] = poller
+    poller.subscribers[subscriber] = float(interval)
+    _update_interval(poller)
+    poller.start()
+    return poller
+
+
+def _update_interval(poller):
+    interval = min(poller.subscribers.values())
+    if interval != poller.base_interval:
+        poller.set_interval(interval)
+
+
+def unsubscribe(ip_address, subscriber):
+    """Drop a subscriber; the poller stops with its last subscriber.
+
+    Otherwise the interval goes back to the fastest one still requested.
+    """
+    poller = _pollers.get(ip_address)
+    if poller is None:
+        return
+    poller.subscribers.pop(subscriber, None)
+    if not poller.subscribers:
+        logger.info(f"No more subscribers for {ip_address}, stopping its poller")
+        stop_poller(ip_address)
+    else:
+        _update_interval(poller)
+
+
+def unsubscribe_all(subscriber):
+    for ip_address, poller in list(_pollers.items()):
+        if subscriber in poller.subscribers:
+            unsubscribe(ip_address, subscriber)
+
+
+def mark_activity(ip_address):
+    poller = _pollers.get(ip_address)
+    if poller is not None:
+        poller.mark_activity()
+
+
+def burst(ip_address):
+    """Poll a board at burst_interval for a short while (button activity)."""
+    poller = _pollers.get(ip_address)
+    if poller is not None:
+        poller.burst()
+
+
+def stop_poller(ip_address):
+    poller = _pollers.pop(ip_address, None)
+    if poller is not None:
+        poller.stop()
+
+
+def stop_all():
+    for ip_address in list(_pollers):
+        stop_poller(ip_address)
+
+
+def poller_stats():
+    return [poller.stats() for poller in _pollers.values()]
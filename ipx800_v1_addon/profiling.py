@@ -0,0 +1,190 @@
+import asyncio
+import collections
+import cProfile
+import io
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_CALLBACK = 0.1
+DEFAULT_LAG_INTERVAL = 1.0
+MAX_EVENTS = 100
+MAX_LAG_SAMPLES = 3600
+STACK_DEPTH = 20
+MAX_PROFILE_SECONDS = 60
+
+# Message du logger asyncio en mode debug pour un callback trop long
+_SLOW_CALLBACK = re.compile(r"Executing (.*) took ([\d.]+) seconds")
+_CORO_NAME = re.compile(r"coro=<([^\s(>]+)")
+
+_state = {"monitor": None, "profiling": False}
+
+
+class LoopMonitor:
+    """Slow callbacks, loop stalls and loop lag of the running event loop.
+
+    - asyncio debug mode reports callbacks longer than `slow_callback`;
+      they are captured from the asyncio logger with their coroutine name;
+    - a ticker task beats every slow_callback / 4 seconds and a watchdog
+      thread grabs the loop thread's stack when the beat stops for longer
+      than `slow_callback`, i.e. while the blocking call is still running;
+    - the worst lag of each `lag_interval` is kept as a time series.
+    """
+
+    def __init__(self, loop, slow_callback, lag_interval):
+        self.loop = loop
+        self.slow_callback = slow_callback
+        self.lag_interval = lag_interval
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+        self.stalls = collections.deque(maxlen=MAX_EVENTS)
+        self.lag_ts = collections.deque(maxlen=MAX_LAG_SAMPLES)
+        self.lag_values = collections.deque(maxlen=MAX_LAG_SAMPLES)
+        self.heartbeat = time.monotonic()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name="ipx800_watchdog", daemon=True)
+        self._ticker = None
+        self._handler = _SlowCallbackHandler(self)
+        self._previous_debug = loop.get_debug()
+
+    def start(self):
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.slow_callback
+        logging.getLogger("asyncio").addHandler(self._handler)
+        self._ticker = self.loop.create_task(self._tick())
+        self._watchdog.start()
+        logger.info(
+            f"Profiling enabled: slow callbacks above {self.slow_callback * 1000:.0f} ms, "
+            f"loop lag every {self.lag_interval}s"
+        )
+
+    def stop(self):
+        self._stopped.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+        logging.getLogger("asyncio").removeHandler(self._handler)
+        self.loop.set_debug(self._previous_debug)
+
+    async def _tick(self):
+        period = self.slow_callback / 4
+        window_start = time.monotonic()
+        worst = 0.0
+        while True:
+            expected = time.monotonic() + period
+            await asyncio.sleep(period)
+            now = time.monotonic()
+            self.heartbeat = now
+            worst = max(worst, now - expected)
+            if now - window_start >= self.lag_interval:
+                self.lag_ts.append(round(time.time(), 3))
+                self.lag_values.append(round(worst, 4))
+                window_start = now
+                worst = 0.0
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.slow_callback / 2):
+            beat = self.heartbeat
+            stalled = time.monotonic() - beat
+            if stalled < self.slow_callback or beat == reported:
+                continue
+            # Une seule capture par blocage, prise pendant qu'il dure
+            reported = beat
+            frame = sys._current_frames().get(self._thread_id)
+            stack = traceback.format_stack(frame)[-STACK_DEPTH:] if frame is not None else []
+            self.stalls.append({
+                "ts": round(time.time(), 3),
+                "stalled": round(stalled, 3),
+                "stack": [line.rstrip() for line in stack],
+            })
+
+    def record_slow_callback(self, callback, duration):
+        match = _CORO_NAME.search(callback)
+        event = {
+            "ts": round(time.time(), 3),
+            "duration": duration,
+            "coroutine": match.group(1) if match else None,
+            "callback": callback[:300],
+            "stack": None,
+        }
+        # Pile capturée par le watchdog pendant ce callback, s'il y en a une
+        if self.stalls and self.stalls[-1]["ts"] >= event["ts"] - duration - self.slow_callback:
+            event["stack"] = self.stalls[-1]["stack"]
+        self.events.append(event)
+
+    def stats(self):
+        lags = sorted(self.lag_values)
+        return {
+            "slow_callback": self.slow_callback,
+            "lag_interval": self.lag_interval,
+            "lag_p50": lags[len(lags) // 2] if lags else None,
+            "lag_max": lags[-1] if lags else None,
+            "lag": {"ts": list(self.lag_ts), "value": list(self.lag_values)},
+            "slow_callbacks": list(self.events),
+            "stalls": list(self.stalls),
+        }
+
+
+class _SlowCallbackHandler(logging.Handler):
+    def __init__(self, monitor):
+        super().__init__(logging.WARNING)
+        self._monitor = monitor
+
+    def emit(self, record):
+        match = _SLOW_CALLBACK.match(record.getMessage())
+        if match:
+            self._monitor.record_slow_callback(match.group(1), float(match.group(2)))
+
+
+def start(loop, slow_callback=DEFAULT_SLOW_CALLBACK, lag_interval=DEFAULT_LAG_INTERVAL):
+    if _state["monitor"] is None:
+        monitor = LoopMonitor(loop, slow_callback, lag_interval)
+        monitor.start()
+        _state["monitor"] = monitor
+    return _state["monitor"]
+
+
+def stop():
+    monitor = _state["monitor"]
+    if monitor is not None:
+        monitor.stop()
+        _state["monitor"] = None
+
+
+def loop_stats():
+    monitor = _state["monitor"]
+    return monitor.stats() if monitor is not None else None
+
+
+async def profile(seconds=5.0, top=30, sort="cumulative"):
+    """Run cProfile on the event loop thread for a few seconds, return the top functions.
+
+    Each row is [ncalls, tottime, cumtime, "file:line(function)"].
+    """
+    if _state["profiling"]:
+        raise RuntimeError("A profile is already running")
+    if sort not in ("cumulative", "tottime", "ncalls"):
+        raise ValueError(f"Unknown sort: {sort}")
+    seconds = min(float(seconds), MAX_PROFILE_SECONDS)
+    profiler = cProfile.Profile()
+    _state["profiling"] = True
+    try:
+        profiler.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+        _state["profiling"] = False
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.sort_stats(sort)
+    rows = []
+    for function in stats.fcn_list[:int(top)]:
+        calls, primitive_calls, tottime, cumtime, _ = stats.stats[function]
+        filename, line, name = function
+        rows.append([calls, round(tottime, 6), round(cumtime, 6), f"{filename}:{line}({name})"])
+    return {"seconds": seconds, "sort": sort, "total_calls": stats.total_calls, "functions": rows}
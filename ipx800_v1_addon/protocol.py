@@ -0,0 +1,64 @@
+import json
+
+from status_parser import STATUS_TAGS, TAG_INDEX
+
+# Protocoles proposés par le client dans "hello", par ordre de préférence
+JSON = "json"
+COMPACT_V1 = "compact1"
+PROTOCOLS = (COMPACT_V1, JSON)
+
+# compact1 : status_update / status_delta encodés en tableau JSON
+#   [kind, ip_address, seq, [tag, value, tag, value, ...]]
+# kind vaut 0 pour un snapshot complet et 1 pour un delta ; tag est l'index
+# de la balise dans STATUS_TAGS (ou son nom si elle est inconnue) et les
+# valeurs numériques sont envoyées comme des entiers.
+KIND_SNAPSHOT = 0
+KIND_DELTA = 1
+_SEPARATORS = (",", ":")
+
+
+def negotiate(offered):
+    """Pick the first protocol offered by the client that we support."""
+    for protocol in offered or ():
+        if protocol in PROTOCOLS:
+            return protocol
+    return JSON
+
+
+def _pack_status(status):
+    packed = []
+    for tag, value in status.items():
+        packed.append(TAG_INDEX.get(tag, tag))
+        # Entiers décimaux sans zéro de tête uniquement, pour un aller-retour exact
+        if value and value.isdigit() and value.isascii() and (len(value) == 1 or value[0] != "0"):
+            value = int(value)
+        packed.append(value)
+    return packed
+
+
+def encode_status(message, protocol):
+    """Serialize a status_update or status_delta message for one protocol."""
+    if protocol != COMPACT_V1:
+        return json.dumps(message)
+    if message["action"] == "status_delta":
+        kind, status = KIND_DELTA, message["changes"]
+    else:
+        kind, status = KIND_SNAPSHOT, message["status"]
+    return json.dumps([kind, message["ip_address"], message["seq"], _pack_status(status)], separators=_SEPARATORS)
+
+
+def decode_message(text):
+    """Decode a message in either protocol back to its JSON dict form."""
+    data = json.loads(text)
+    if not isinstance(data, list):
+        return data
+    kind, ip_address, seq, packed = data
+    status = {}
+    for index in range(0, len(packed), 2):
+        tag, value = packed[index], packed[index + 1]
+        if isinstance(tag, int):
+            tag = STATUS_TAGS[tag]
+        status[tag] = str(value) if isinstance(value, int) else value
+    if kind == KIND_DELTA:
+        return {"action": "status_delta", "ip_address": ip_address, "seq": seq, "changes": status}
+    return {"action": "status_update", "ip_address": ip_address, "seq": seq, "status": status}
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+import http_pool
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Réponses d'un firmware qui ne comprend pas plusieurs LED par requête ;
+# les autres erreurs (500, 503 d'une carte occupée) sont passagères
+REFUSED_STATUSES = (400, 404)
+
+_settings = {"batch": True}
+# Cartes dont le firmware refuse plusieurs LED dans un même preset.htm
+_unbatched = set()
+
+
+def configure(batch=None):
+    if batch is not None:
+        _settings["batch"] = batch
+
+
+def _led_param(led, on):
+    return f"{led}={'1' if on else '0'}"
+
+
+async def write_leds(ip_address, leds):
+    """Apply {led: bool} on a board with as few preset.htm requests as possible.
+
+    Returns one aggregated result: {"ip_address", "ok", "requests", "leds": {led: ok}}.
+    """
+    start = time.perf_counter()
+    result = await _write_leds(ip_address, leds)
+    metrics.RELAY_WRITE_SECONDS.observe(time.perf_counter() - start, ip_address)
+    metrics.RELAY_REQUESTS.inc(ip_address, amount=result["requests"])
+    if not result["ok"]:
+        metrics.RELAY_ERRORS.inc(ip_address)
+    return result
+
+
+async def _write_leds(ip_address, leds):
+    pool = http_pool.get_pool(ip_address)
+    result = {"ip_address": ip_address, "ok": True, "requests": 0, "leds": {}}
+    if not leds:
+        return result
+
+    if len(leds) > 1 and _settings["batch"] and ip_address not in _unbatched:
+        query = "&".join(_led_param(led, on) for led, on in leds.items())
+        result["requests"] += 1
+        try:
+            status, _ = await pool.get(f"/preset.htm?{query}")
+        except Exception as e:
+            # Carte injoignable (timeout, connexion) : N requêtes de plus n'aideraient pas
+            logger.error(f"Error setting LEDs {query} on {ip_address}: {e}")
+            result["ok"] = False
+            result["leds"] = {led: False for led in leds}
+            return result
+        if status == 200:
+            result["leds"] = {led: True for led in leds}
+            return result
+        if status not in REFUSED_STATUSES:
+            logger.error(f"Error setting LEDs {query} on {ip_address}: {status}")
+            result["ok"] = False
+            result["leds"] = {led: False for led in leds}
+            return result
+        # Refus explicite du firmware : repli sur une requête par LED
+        logger.warning(f"Batched preset.htm refused by {ip_address} ({status}), using one request per LED")
+        _unbatched.add(ip_address)
+
+    # Repli : une requête par LED, envoyées en parallèle
+    items = list(leds.items())
+    result["requests"] += len(items)
+    responses = await asyncio.gather(
+        *(pool.get(f"/preset.htm?{_led_param(led, on)}") for led, on in items),
+        return_exceptions=True
+    )
+    for (led, on), response in zip(items, responses):
+        if isinstance(response, Exception):
+            logger.error(f"Error setting LED {led} to state {'1' if on else '0'}: {response}")
+            ok = False
+        else:
+            ok = response[0] == 200
+            if not ok:
+                logger.error(f"Error setting LED {led} to state {'1' if on else '0'}: {response[0]}")
+        result["leds"][led] = ok
+        result["ok"] = result["ok"] and ok
+    return result
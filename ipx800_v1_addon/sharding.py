@@ -0,0 +1,316 @@
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Actions sans adresse IP qui concernent toutes les cartes : chaque worker
+# répond et les listes des réponses sont concaténées.
+GATHER_ACTIONS = (
+    "resync",
+    "get_pool_stats",
+    "get_poll_stats",
+    "get_queue_stats",
+    "get_button_stats",
+    "get_history_stats",
+)
+GATHER_TIMEOUT = 10.0
+STOP_TIMEOUT = 10.0
+RESTART_DELAY = 1.0
+# Une réponse get_history peut être longue : une ligne JSON par message
+LINE_LIMIT = 1 << 24
+
+_workers = []
+_gathers = {}
+_gather_ids = itertools.count(1)
+_clients = {}
+_state = {"stopping": False, "on_restart": None}
+
+
+class WorkerProcess:
+    """One board worker: a child process running the addon with --worker.
+
+    Messages are JSON lines, front end -> worker on stdin and worker ->
+    front end on stdout; the worker logs on stderr.
+    """
+
+    def __init__(self, index, argv):
+        self.index = index
+        self._argv = argv
+        self.process = None
+        self._reader = None
+        self.restarts = 0
+        self.sent = 0
+        self.received = 0
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self._argv, str(self.index),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=LINE_LIMIT,
+        )
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+        logger.info(f"Worker {self.index} started (pid {self.process.pid})")
+
+    def send(self, envelope):
+        if self.process is None or self.process.stdin.is_closing():
+            return False
+        self.process.stdin.write(json.dumps(envelope).encode() + b"\n")
+        self.sent += 1
+        return True
+
+    async def _read(self):
+        async for line in self.process.stdout:
+            self.received += 1
+            try:
+                _on_worker_message(json.loads(line))
+            except Exception as e:
+                logger.error(f"Bad message from worker {self.index}: {e}")
+        code = await self.process.wait()
+        if _state["stopping"]:
+            return
+        logger.error(f"Worker {self.index} exited with code {code}, restarting")
+        self.restarts += 1
+        await asyncio.sleep(RESTART_DELAY)
+        await self.start()
+        # Les abonnements perdus avec le worker sont refaits à la reconnexion des clients
+        if _state["on_restart"] is not None:
+            _state["on_restart"](self.index)
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        # Fin de stdin : le worker ferme ses pollers et ses bases puis s'arrête
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker {self.index} did not stop, killing it")
+            self.process.kill()
+            await self.process.wait()
+
+    def stats(self):
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process is not None else None,
+            "restarts": self.restarts,
+            "sent": self.sent,
+            "received": self.received,
+        }
+
+
+def _on_worker_message(envelope):
+    if "gather" in envelope:
+        pending = _gathers.get(envelope["gather"])
+        if pending is not None:
+            future, responses = pending
+            responses.append(envelope)
+            if len(responses) == len(_workers) and not future.done():
+                future.set_result(responses)
+        return
+    client = _clients.get(envelope["client"])
+    if client is not None:
+        client.send_nowait(envelope["message"])
+
+
+def enabled():
+    return bool(_workers)
+
+
+def worker_for(ip_address):
+    # crc32 plutôt que hash() : même répartition à chaque démarrage
+    return _workers[zlib.crc32(ip_address.encode()) % len(_workers)]
+
+
+async def start_workers(count, argv, on_restart=None):
+    _state["stopping"] = False
+    _state["on_restart"] = on_restart
+    for index in range(count):
+        worker = WorkerProcess(index, argv)
+        await worker.start()
+        _workers.append(worker)
+
+
+async def stop_workers():
+    _state["stopping"] = True
+    await asyncio.gather(*(worker.stop() for worker in _workers), return_exceptions=True)
+    _workers.clear()
+
+
+def add_client(client):
+    _clients[client.id] = client
+
+
+def remove_client(client):
+    """Forget a disconnected client, in the front end and in every worker."""
+    _clients.pop(client.id, None)
+    for worker in _workers:
+        worker.send({"disconnect": client.id})
+
+
+def route(client, data):
+    """Forward a request to the worker owning its board, or to data["worker"].
+
+    The reply comes back through the worker; returns False when there is
+    no such worker or it is restarting.
+    """
+    if "worker" in data:
+        index = data["worker"]
+        if not isinstance(index, int) or not 0 <= index < len(_workers):
+            return False
+        worker = _workers[index]
+    else:
+        worker = worker_for(data["ip_address"])
+    return worker.send({"client": client.id, "protocol": client.protocol, "data": data})
+
+
+async def _gather(envelope):
+    """Send an envelope to every worker, return {worker index: reply}."""
+    gather_id = next(_gather_ids)
+    future = asyncio.get_running_loop().create_future()
+    _gathers[gather_id] = (future, [])
+    try:
+        for worker in _workers:
+            worker.send({**envelope, "gather": gather_id})
+        replies = await asyncio.wait_for(future, GATHER_TIMEOUT)
+    finally:
+        _gathers.pop(gather_id, None)
+    return {reply.get("worker"): reply.get("response") for reply in replies}
+
+
+async def gather(client, data):
+    """Run a request on every worker and merge the replies."""
+    try:
+        responses = await _gather({"client": client.id, "protocol": client.protocol, "data": data})
+    except asyncio.TimeoutError:
+        response = {"action": "error", "error": "Timeout waiting for the board workers"}
+        if "id" in data:
+            response["id"] = data["id"]
+        return response
+    return merge_responses([response for response in responses.values() if response is not None])
+
+
+async def collect(data):
+    """Run an internal request (no client) on every worker: {worker index: reply}."""
+    return await _gather({"data": data})
+
+
+def merge_responses(responses):
+    """Concatenate the list fields of per-worker replies; an error wins."""
+    if not responses:
+        return None
+    for response in responses:
+        if response.get("action") == "error":
+            return response
+    merged = dict(responses[0])
+    for response in responses[1:]:
+        for key, value in response.items():
+            if isinstance(value, list) and isinstance(merged.get(key), list):
+                merged[key] = merged[key] + value
+    return merged
+
+
+def worker_stats():
+    return [worker.stats() for worker in _workers]
+
+
+class RemoteClient:
+    """Worker-side stand-in for a websocket client of the front end.
+
+    Requests of one client are processed in order, as the front end does
+    for a direct connection.
+    """
+
+    def __init__(self, client_id, channel, process_request, index):
+        self.id = client_id
+        self.index = index
+        self.protocol = "json"
+        self.closed = False
+        self._channel = channel
+        self._process_request = process_request
+        self._requests = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def send_nowait(self, message):
+        if self.closed:
+            return False
+        self._channel.write(json.dumps({"client": self.id, "message": message}).encode() + b"\n")
+        return True
+
+    async def send(self, message):
+        self.send_nowait(message)
+
+    def submit(self, data, gather_id=None):
+        self._requests.put_nowait((data, gather_id))
+
+    async def _run(self):
+        while True:
+            data, gather_id = await self._requests.get()
+            response = await self._process_request(self, data)
+            if gather_id is not None:
+                _reply(self._channel, gather_id, self.index, response)
+            elif response is not None:
+                self.send_nowait(json.dumps(response))
+
+    def stats(self):
+        return {"id": self.id, "protocol": self.protocol, "queued": self._requests.qsize()}
+
+    def close(self):
+        self.closed = True
+        self._task.cancel()
+
+
+def _reply(channel, gather_id, index, response):
+    channel.write(json.dumps({"gather": gather_id, "worker": index, "response": response}).encode() + b"\n")
+
+
+async def _answer(channel, process_request, index, envelope):
+    response = await process_request(None, envelope["data"])
+    _reply(channel, envelope["gather"], index, response)
+
+
+async def _open_stdio():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+
+async def run_worker(index, process_request, forget_client):
+    """Serve the front end's requests until stdin closes.
+
+    process_request(client, data) returns the reply owed to a request
+    (client is None for the front end's own requests, e.g. metrics);
+    forget_client(client) drops a disconnected client's subscriptions.
+    """
+    reader, writer = await _open_stdio()
+    loop = asyncio.get_running_loop()
+    remotes = {}
+    tasks = set()
+    async for line in reader:
+        envelope = json.loads(line)
+        if "disconnect" in envelope:
+            client = remotes.pop(envelope["disconnect"], None)
+            if client is not None:
+                client.close()
+                forget_client(client)
+            continue
+        if "client" not in envelope:
+            task = loop.create_task(_answer(writer, process_request, index, envelope))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            continue
+        client = remotes.get(envelope["client"])
+        if client is None:
+            client = remotes[envelope["client"]] = RemoteClient(envelope["client"], writer, process_request, index)
+        client.protocol = envelope.get("protocol", client.protocol)
+        client.submit(envelope["data"], envelope.get("gather"))
+    for client in remotes.values():
+        client.close()
+        forget_client(client)
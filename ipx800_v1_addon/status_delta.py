@@ -0,0 +1,87 @@
+from status_parser import STATUS_TAGS
+
+_MISSING = object()
+_trackers = {}
+
+
+class StatusTracker:
+    """Last known status.xml snapshot of one board and its sequence number.
+
+    The sequence number is bumped every time at least one tag changes, so a
+    client that sees a gap knows it has to ask for a resync. Clients
+    subscribed to some channels only get their own sequence per channel
+    set, bumped only by the deltas they receive.
+    """
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+        self.snapshot = {}
+        self.seq = 0
+        self._values = [None] * len(STATUS_TAGS)
+        # frozenset de canaux -> numéro de séquence des deltas filtrés
+        self._channel_seqs = {}
+
+    def update_record(self, record):
+        """Merge a freshly parsed StatusRecord, return only the tags that changed.
+
+        Values are compared by schema position; tags absent from the record
+        (truncated response) keep their last value.
+        """
+        changes = {}
+        last_values = self._values
+        for index, value in enumerate(record.values):
+            if value is not None and value != last_values[index]:
+                last_values[index] = value
+                changes[STATUS_TAGS[index]] = value
+        snapshot = self.snapshot
+        for tag, value in record.extra.items():
+            if snapshot.get(tag, _MISSING) != value:
+                changes[tag] = value
+        if changes:
+            snapshot.update(changes)
+            self.seq += 1
+        return changes
+
+    def channel_seq(self, channels):
+        """Sequence number seen by subscribers of these channels (None: all)."""
+        return self.seq if channels is None else self._channel_seqs.get(channels, 0)
+
+    def next_channel_seq(self, channels):
+        """Sequence number of a delta published to these channels."""
+        if channels is None:
+            return self.seq
+        seq = self._channel_seqs[channels] = self._channel_seqs.get(channels, 0) + 1
+        return seq
+
+    def delta_message(self, changes, seq=None):
+        return {
+            "action": "status_delta",
+            "ip_address": self.ip_address,
+            "seq": self.seq if seq is None else seq,
+            "changes": changes,
+        }
+
+    def snapshot_message(self):
+        return {
+            "action": "status_update",
+            "ip_address": self.ip_address,
+            "seq": self.seq,
+            "status": dict(self.snapshot),
+        }
+
+
+def get_tracker(ip_address):
+    tracker = _trackers.get(ip_address)
+    if tracker is None:
+        tracker = StatusTracker(ip_address)
+        _trackers[ip_address] = tracker
+    return tracker
+
+
+def snapshot_messages(ip_address=None):
+    """Full snapshots for one board, or for every board already polled."""
+    if ip_address is not None:
+        trackers = [_trackers[ip_address]] if ip_address in _trackers else []
+    else:
+        trackers = list(_trackers.values())
+    return [tracker.snapshot_message() for tracker in trackers if tracker.seq > 0]
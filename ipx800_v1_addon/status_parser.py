@@ -0,0 +1,55 @@
+import re
+
+# Balises connues du status.xml d'une IPX800 V1
+STATUS_TAGS = (
+    "led0", "led1", "led2", "led3", "led4", "led5", "led6", "led7",
+    "btn0", "btn1", "btn2", "btn3",
+    "an0", "an1",
+    "count0", "count1", "count2",
+)
+TAG_INDEX = {tag: index for index, tag in enumerate(STATUS_TAGS)}
+
+# Un élément feuille complet : <tag>texte</tag>. Un élément tronqué en fin
+# de réponse ne correspond pas et est simplement ignoré.
+_ELEMENT = re.compile(r"<([A-Za-z_][\w.-]*)>([^<]*)</\1>")
+
+
+class StatusRecord:
+    """Parsed status.xml: known tags by schema position, anything else in extra."""
+
+    __slots__ = ("values", "extra")
+
+    def __init__(self):
+        self.values = [None] * len(STATUS_TAGS)
+        self.extra = {}
+
+    def get(self, tag, default=None):
+        index = TAG_INDEX.get(tag)
+        if index is None:
+            return self.extra.get(tag, default)
+        value = self.values[index]
+        return default if value is None else value
+
+    def as_dict(self):
+        status = {tag: value for tag, value in zip(STATUS_TAGS, self.values) if value is not None}
+        status.update(self.extra)
+        return status
+
+
+def parse_status(xml_data):
+    """Parse an IPX800 V1 status.xml without building a DOM.
+
+    Tags missing from a truncated response are left to None.
+    """
+    record = StatusRecord()
+    values = record.values
+    extra = record.extra
+    tag_index = TAG_INDEX
+    for match in _ELEMENT.finditer(xml_data):
+        tag, text = match.groups()
+        index = tag_index.get(tag)
+        if index is None:
+            extra[tag] = text or None
+        else:
+            values[index] = text or None
+    return record
@@ -0,0 +1,533 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Surchargeable pour lancer l'addon hors de Home Assistant (benchmarks)
+DB_DIR = os.environ.get("IPX800_DB_DIR", "/config")
+DB_NAME = "ipx800.db"
+# Fichiers par carte des versions précédentes, importés au premier démarrage
+LEGACY_PATTERN = "ipx800_*.db"
+DEFAULT_COMMIT_DELAY = 0.05
+# Plusieurs process (workers) partagent la base : attendre le verrou
+BUSY_TIMEOUT = 30.0
+
+# Un seul thread et une seule connexion SQLite par process : elle n'est
+# jamais utilisée depuis la boucle asyncio.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ipx800_db")
+_settings = {"commit_delay": DEFAULT_COMMIT_DELAY}
+_state = {"database": None}
+# ip_address -> boards.id, lu et écrit uniquement sur le thread de la base
+_board_ids = {}
+
+# Noms des LED par masque : le bit i correspond à "led<i>"
+LED_COUNT = 8
+MASK_LEDS = tuple(
+    tuple(f"led{index}" for index in range(LED_COUNT) if mask >> index & 1)
+    for mask in range(1 << LED_COUNT)
+)
+
+
+def leds_to_mask(leds):
+    mask = 0
+    for led in leds:
+        mask |= 1 << int(led[3:])
+    return mask
+
+
+def mask_to_leds(mask):
+    return MASK_LEDS[mask]
+
+
+class Database:
+    """Persistent WAL-mode SQLite connection to the database of every board.
+
+    Every query runs on the storage thread; writes are committed in
+    batches `commit_delay` seconds after the first uncommitted write, or
+    with the write itself when `commit_delay` is 0.
+    """
+
+    def __init__(self, db_path, commit_delay):
+        self.db_path = db_path
+        self._commit_delay = commit_delay
+        self._conn = None
+        self._commit_handle = None
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, cached_statements=128, timeout=BUSY_TIMEOUT
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            migrate(conn)
+            import_legacy(conn, os.path.dirname(self.db_path))
+            self._conn = conn
+        return self._conn
+
+    async def open(self):
+        """Create, migrate and import the database now instead of on the first query."""
+        await asyncio.get_running_loop().run_in_executor(_executor, self._connection)
+
+    def _call(self, func, args, commit_now=False):
+        result = func(self._connection(), *args)
+        if commit_now:
+            self._conn.commit()
+        return result
+
+    async def run(self, func, *args, commit=False):
+        """Run func(conn, *args) on the storage thread."""
+        loop = asyncio.get_running_loop()
+        operation = func.__name__.lstrip("_")
+        # Sans délai, le commit suit l'écriture sur le même appel
+        commit_now = commit and self._commit_delay <= 0
+        start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(_executor, self._call, func, args, commit_now)
+        except Exception:
+            metrics.DB_ERRORS.inc(operation)
+            raise
+        finally:
+            metrics.DB_SECONDS.observe(time.perf_counter() - start, operation)
+        if commit and not commit_now:
+            self._schedule_commit(loop)
+        return result
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(_fetchall, sql, params)
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(_fetchone, sql, params)
+
+    async def write(self, sql, params=()):
+        return await self.run(_write, sql, params, commit=True)
+
+    async def write_many(self, sql, seq_of_params):
+        return await self.run(_write_many, sql, list(seq_of_params), commit=True)
+
+    async def flush(self):
+        """Commit pending writes now, for writes a reply must guarantee."""
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        await asyncio.get_running_loop().run_in_executor(_executor, self._commit)
+
+    def _schedule_commit(self, loop):
+        if self._commit_handle is None:
+            self._commit_handle = loop.call_later(self._commit_delay, self._commit_later, loop)
+
+    def _commit_later(self, loop):
+        self._commit_handle = None
+        loop.run_in_executor(_executor, self._commit)
+
+    def _commit(self):
+        try:
+            if self._conn is not None:
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error committing {self.db_path}: {e}")
+
+    def _close(self):
+        if self._conn is not None:
+            self._commit()
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        await asyncio.get_running_loop().run_in_executor(_executor, self._close)
+
+
+def _migration_1(conn):
+    """Legacy layout, as created ad hoc by earlier versions."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS infos (
+            device_name TEXT,
+            ip_address TEXT,
+            poll_interval INTEGER,
+            unique_id TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS devices (
+            device_name TEXT,
+            input_button TEXT,
+            select_leds TEXT,
+            unique_id TEXT,
+            variable_etat_name TEXT,
+            ip_address TEXT,
+            state TEXT DEFAULT 'off'
+        )
+    ''')
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(devices)")]
+    if 'ip_address' not in columns:
+        conn.execute('ALTER TABLE devices ADD COLUMN ip_address TEXT')
+    if 'state' not in columns:
+        conn.execute("ALTER TABLE devices ADD COLUMN state TEXT DEFAULT 'off'")
+
+
+def _migration_2(conn):
+    """Primary keys, unique names, LED bitmask and lookup indexes."""
+    conn.execute('''
+        CREATE TABLE infos_new (
+            id INTEGER PRIMARY KEY,
+            device_name TEXT NOT NULL,
+            ip_address TEXT NOT NULL,
+            poll_interval INTEGER,
+            unique_id TEXT,
+            UNIQUE (ip_address, device_name)
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO infos_new (device_name, ip_address, poll_interval, unique_id)
+        SELECT device_name, ip_address, poll_interval, unique_id FROM infos ORDER BY rowid
+    ''')
+    conn.execute('DROP TABLE infos')
+    conn.execute('ALTER TABLE infos_new RENAME TO infos')
+
+    conn.execute('''
+        CREATE TABLE devices_new (
+            id INTEGER PRIMARY KEY,
+            device_name TEXT NOT NULL,
+            input_button TEXT,
+            select_leds TEXT,
+            led_mask INTEGER NOT NULL DEFAULT 0,
+            unique_id TEXT,
+            variable_etat_name TEXT,
+            ip_address TEXT,
+            state TEXT DEFAULT 'off',
+            UNIQUE (ip_address, device_name)
+        )
+    ''')
+    # Les anciennes lignes sans adresse IP appartiennent à la carte du fichier
+    board = conn.execute('SELECT ip_address FROM infos ORDER BY id LIMIT 1').fetchone()
+    rows = conn.execute('''
+        SELECT device_name, input_button, select_leds, unique_id, variable_etat_name, ip_address, state
+        FROM devices ORDER BY rowid
+    ''').fetchall()
+    for device_name, input_button, select_leds, unique_id, variable_etat_name, ip_address, state in rows:
+        leds = [led for led in (select_leds or "").split(",") if led]
+        conn.execute('''
+            INSERT OR IGNORE INTO devices_new
+                (device_name, input_button, select_leds, led_mask, unique_id, variable_etat_name, ip_address, state)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            device_name, input_button, select_leds, leds_to_mask(leds), unique_id, variable_etat_name,
+            ip_address or (board[0] if board else None), state or 'off'
+        ))
+    conn.execute('DROP TABLE devices')
+    conn.execute('ALTER TABLE devices_new RENAME TO devices')
+    conn.execute('CREATE INDEX idx_devices_button ON devices (ip_address, input_button)')
+    conn.execute('CREATE INDEX idx_devices_name ON devices (device_name)')
+
+
+def _migration_3(conn):
+    """History of status values: raw changes plus minute and hour rollups."""
+    conn.execute('''
+        CREATE TABLE history (
+            ts REAL NOT NULL,
+            tag INTEGER NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_history_tag_ts ON history (tag, ts)')
+    for table in ('history_minute', 'history_hour'):
+        conn.execute(f'''
+            CREATE TABLE {table} (
+                tag INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                avg REAL NOT NULL,
+                min REAL NOT NULL,
+                max REAL NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (tag, ts)
+            ) WITHOUT ROWID
+        ''')
+
+
+def _migration_4(conn):
+    """One database for every board: boards table and board_id foreign keys."""
+    conn.execute('''
+        CREATE TABLE boards (
+            id INTEGER PRIMARY KEY,
+            ip_address TEXT NOT NULL UNIQUE,
+            device_name TEXT,
+            poll_interval REAL,
+            unique_id TEXT
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO boards (ip_address, device_name, poll_interval, unique_id)
+        SELECT ip_address, device_name, poll_interval, unique_id FROM infos ORDER BY id
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO boards (ip_address)
+        SELECT DISTINCT ip_address FROM devices WHERE ip_address IS NOT NULL
+    ''')
+    conn.execute('DROP TABLE infos')
+    # Lignes sans carte connue : celle du fichier, c'est-à-dire la première
+    first_board = '(SELECT id FROM boards ORDER BY id LIMIT 1)'
+
+    conn.execute('''
+        CREATE TABLE devices_new (
+            id INTEGER PRIMARY KEY,
+            board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+            device_name TEXT NOT NULL,
+            input_button TEXT,
+            select_leds TEXT,
+            led_mask INTEGER NOT NULL DEFAULT 0,
+            unique_id TEXT,
+            variable_etat_name TEXT,
+            state TEXT DEFAULT 'off',
+            UNIQUE (board_id, device_name)
+        )
+    ''')
+    conn.execute(f'''
+        INSERT OR IGNORE INTO devices_new
+            (id, board_id, device_name, input_button, select_leds, led_mask, unique_id, variable_etat_name, state)
+        SELECT d.id, COALESCE(b.id, {first_board}), d.device_name, d.input_button, d.select_leds, d.led_mask,
+               d.unique_id, d.variable_etat_name, d.state
+        FROM devices d LEFT JOIN boards b ON b.ip_address = d.ip_address
+        WHERE COALESCE(b.id, {first_board}) IS NOT NULL
+        ORDER BY d.id
+    ''')
+    conn.execute('DROP TABLE devices')
+    conn.execute('ALTER TABLE devices_new RENAME TO devices')
+    conn.execute('CREATE INDEX idx_devices_board_button ON devices (board_id, input_button)')
+
+    conn.execute('''
+        CREATE TABLE history_new (
+            board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+            ts REAL NOT NULL,
+            tag INTEGER NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    conn.execute(f'INSERT INTO history_new SELECT {first_board}, ts, tag, value FROM history WHERE {first_board} IS NOT NULL')
+    conn.execute('DROP TABLE history')
+    conn.execute('ALTER TABLE history_new RENAME TO history')
+    conn.execute('CREATE INDEX idx_history_board_tag_ts ON history (board_id, tag, ts)')
+    for table in ('history_minute', 'history_hour'):
+        conn.execute(f'''
+            CREATE TABLE {table}_new (
+                board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+                tag INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                avg REAL NOT NULL,
+                min REAL NOT NULL,
+                max REAL NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (board_id, tag, ts)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'''
+            INSERT INTO {table}_new SELECT {first_board}, tag, ts, avg, min, max, count FROM {table}
+            WHERE {first_board} IS NOT NULL
+        ''')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+    conn.execute('CREATE TABLE imported_files (name TEXT PRIMARY KEY, imported_at REAL)')
+
+
+def _migration_5(conn):
+    """LED mapping kept only as led_mask: drop the select_leds text column."""
+    conn.execute('''
+        CREATE TABLE devices_new (
+            id INTEGER PRIMARY KEY,
+            board_id INTEGER NOT NULL REFERENCES boards (id) ON DELETE CASCADE,
+            device_name TEXT NOT NULL,
+            input_button TEXT,
+            led_mask INTEGER NOT NULL DEFAULT 0,
+            unique_id TEXT,
+            variable_etat_name TEXT,
+            state TEXT DEFAULT 'off',
+            UNIQUE (board_id, device_name)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO devices_new
+            (id, board_id, device_name, input_button, led_mask, unique_id, variable_etat_name, state)
+        SELECT id, board_id, device_name, input_button, led_mask, unique_id, variable_etat_name, state
+        FROM devices ORDER BY id
+    ''')
+    conn.execute('DROP TABLE devices')
+    conn.execute('ALTER TABLE devices_new RENAME TO devices')
+    conn.execute('CREATE INDEX idx_devices_board_button ON devices (board_id, input_button)')
+
+
+# Migrations du schéma, appliquées dans l'ordre ; PRAGMA user_version
+# contient le nombre de migrations déjà appliquées.
+MIGRATIONS = (
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+)
+# Dernière version du schéma à un fichier par carte
+LEGACY_VERSION = 3
+
+
+def migrate(conn, target=None):
+    target = len(MIGRATIONS) if target is None else target
+    while True:
+        with conn:
+            # Transaction explicite (le DDL n'en ouvre pas implicitement) et
+            # immédiate : un autre process peut migrer la même base
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= target:
+                return
+            logger.info(f"Migrating database schema to version {version + 1}")
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
+
+def rollup_merge_sql(table):
+    """Upsert of (board_id, tag, ts, avg, min, max, count), merged with an existing period."""
+    return f'''
+        INSERT INTO {table} (board_id, tag, ts, avg, min, max, count) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (board_id, tag, ts) DO UPDATE SET
+            avg = (avg * count + excluded.avg * excluded.count) / (count + excluded.count),
+            min = MIN(min, excluded.min),
+            max = MAX(max, excluded.max),
+            count = count + excluded.count
+    '''
+
+
+def board_id(conn, ip_address):
+    """Id of a board in the boards table, created on first use."""
+    board = _board_ids.get(ip_address)
+    if board is None:
+        conn.execute('INSERT OR IGNORE INTO boards (ip_address) VALUES (?)', (ip_address,))
+        board = conn.execute('SELECT id FROM boards WHERE ip_address = ?', (ip_address,)).fetchone()[0]
+        _board_ids[ip_address] = board
+    return board
+
+
+def import_legacy(conn, directory):
+    """Merge the per-board files of earlier versions, once each.
+
+    The files are left untouched, so an older addon can still use them.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, LEGACY_PATTERN))):
+        name = os.path.basename(path)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute('SELECT 1 FROM imported_files WHERE name = ?', (name,)).fetchone():
+                continue
+            try:
+                legacy = _load_legacy(path, name[len("ipx800_"):-len(".db")])
+            except sqlite3.Error as e:
+                logger.error(f"Cannot import {name}: {e}")
+                continue
+            try:
+                boards, devices = _merge_legacy(conn, legacy)
+            finally:
+                legacy.close()
+            conn.execute('INSERT INTO imported_files (name, imported_at) VALUES (?, ?)', (name, time.time()))
+            logger.info(f"Imported {name}: {boards} board(s), {devices} device(s)")
+
+
+def _load_legacy(path, ip_address):
+    """In-memory copy of a per-board file, migrated to the current schema."""
+    source = sqlite3.connect(f"file:{urllib.parse.quote(path)}?mode=ro", uri=True)
+    legacy = sqlite3.connect(":memory:")
+    try:
+        source.backup(legacy)
+    finally:
+        source.close()
+    migrate(legacy, LEGACY_VERSION)
+    # La carte du fichier, si elle n'y a jamais été enregistrée
+    with legacy:
+        legacy.execute(
+            "INSERT INTO infos (device_name, ip_address) SELECT '', ? WHERE NOT EXISTS (SELECT 1 FROM infos)",
+            (ip_address,)
+        )
+    migrate(legacy)
+    return legacy
+
+
+def _merge_legacy(conn, legacy):
+    board_ids = {}
+    for legacy_id, ip_address, device_name, poll_interval, unique_id in legacy.execute(
+        'SELECT id, ip_address, device_name, poll_interval, unique_id FROM boards'
+    ):
+        conn.execute('''
+            INSERT INTO boards (ip_address, device_name, poll_interval, unique_id) VALUES (?, ?, ?, ?)
+            ON CONFLICT (ip_address) DO UPDATE SET
+                device_name = COALESCE(device_name, excluded.device_name),
+                poll_interval = COALESCE(poll_interval, excluded.poll_interval),
+                unique_id = COALESCE(unique_id, excluded.unique_id)
+        ''', (ip_address, device_name or None, poll_interval, unique_id))
+        board_ids[legacy_id] = board_id(conn, ip_address)
+    devices = conn.executemany('''
+        INSERT OR IGNORE INTO devices
+            (board_id, device_name, input_button, led_mask, unique_id, variable_etat_name, state)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (board_ids[row[0]],) + row[1:] for row in legacy.execute('''
+            SELECT board_id, device_name, input_button, led_mask, unique_id, variable_etat_name, state
+            FROM devices ORDER BY id
+        ''')
+    ]).rowcount
+    conn.executemany('INSERT INTO history (board_id, ts, tag, value) VALUES (?, ?, ?, ?)', [
+        (board_ids[row[0]],) + row[1:] for row in legacy.execute('SELECT board_id, ts, tag, value FROM history')
+    ])
+    for table in ('history_minute', 'history_hour'):
+        conn.executemany(rollup_merge_sql(table), [
+            (board_ids[row[0]],) + row[1:]
+            for row in legacy.execute(f'SELECT board_id, tag, ts, avg, min, max, count FROM {table}')
+        ])
+    return len(board_ids), devices
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+
+def _write(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def _write_many(conn, sql, seq_of_params):
+    return conn.executemany(sql, seq_of_params).rowcount
+
+
+def configure(commit_delay=None):
+    if commit_delay is not None:
+        _settings["commit_delay"] = commit_delay
+
+
+def get_database():
+    database = _state["database"]
+    if database is None:
+        database = _state["database"] = Database(os.path.join(DB_DIR, DB_NAME), **_settings)
+    return database
+
+
+async def close():
+    database = _state["database"]
+    if database is None:
+        return
+    try:
+        await database.close()
+    except Exception as e:
+        logger.error(f"Error closing {database.db_path}: {e}")
+    _state["database"] = None
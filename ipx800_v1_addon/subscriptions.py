@@ -0,0 +1,46 @@
+import re
+
+# Canaux auxquels un client peut s'abonner pour une carte
+CHANNELS = ("led", "btn", "an", "count", "entity")
+
+_CHANNEL = re.compile(r"\d+$")
+# ip_address -> {client: frozenset de canaux, ou None pour tous}
+_boards = {}
+
+
+def tag_channel(tag):
+    """Channel of a status.xml tag: led3 -> led, count0 -> count."""
+    return _CHANNEL.sub("", tag)
+
+
+def subscribe(client, ip_address, channels=None):
+    if channels is not None:
+        channels = frozenset(channels)
+    _boards.setdefault(ip_address, {})[client] = channels
+    return channels
+
+
+def unsubscribe(client, ip_address=None):
+    boards = [ip_address] if ip_address is not None else list(_boards)
+    for ip in boards:
+        board = _boards.get(ip)
+        if board is None:
+            continue
+        board.pop(client, None)
+        if not board:
+            del _boards[ip]
+
+
+def subscribers(ip_address, channel=None):
+    """Clients of a board, optionally only those listening to one channel."""
+    board = _boards.get(ip_address, {})
+    if channel is None:
+        return dict(board)
+    return {client: channels for client, channels in board.items() if channels is None or channel in channels}
+
+
+def filter_status(status, channels):
+    """Keep only the tags of the given channels (None keeps everything)."""
+    if channels is None:
+        return status
+    return {tag: value for tag, value in status.items() if tag_channel(tag) in channels}
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ipx800_v1_addon"))
+
+import storage  # noqa: E402
+
+
+def create_legacy(path, ip_address, devices):
+    """Per-board file as written by the versions before the migrations."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE infos (device_name TEXT, ip_address TEXT, poll_interval INTEGER, unique_id TEXT)")
+    conn.execute(
+        "CREATE TABLE devices (device_name TEXT, input_button TEXT, select_leds TEXT, unique_id TEXT, "
+        "variable_etat_name TEXT, ip_address TEXT, state TEXT DEFAULT 'off')"
+    )
+    conn.execute("INSERT INTO infos VALUES (?, ?, ?, ?)", ("board", ip_address, 10, "uid"))
+    for device_name, select_leds, state in devices:
+        # Les plus anciennes lignes n'ont pas d'adresse IP
+        conn.execute(
+            "INSERT INTO devices VALUES (?, 'btn0', ?, 'uid', ?, NULL, ?)",
+            (device_name, select_leds, f"etat_{device_name}", state)
+        )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(autouse=True)
+def clear_board_ids():
+    storage._board_ids.clear()
+    yield
+    storage._board_ids.clear()
+
+
+def columns(conn, table):
+    return [column[1] for column in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def test_migrate_legacy_layout(tmp_path):
+    path = str(tmp_path / "ipx800_10.0.0.1.db")
+    create_legacy(path, "10.0.0.1", [("lamp", "led0,led2", "on"), ("fan", "led7", None), ("lamp", "led1", "off")])
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(storage.MIGRATIONS)
+    assert "select_leds" not in columns(conn, "devices")
+    assert conn.execute("SELECT ip_address, device_name, poll_interval FROM boards").fetchall() == [
+        ("10.0.0.1", "board", 10.0)
+    ]
+    # Doublon de nom : la première ligne est gardée
+    assert conn.execute('''
+        SELECT b.ip_address, d.device_name, d.led_mask, d.state
+        FROM devices d JOIN boards b ON b.id = d.board_id ORDER BY d.id
+    ''').fetchall() == [("10.0.0.1", "lamp", 0b101, "on"), ("10.0.0.1", "fan", 0b10000000, "off")]
+    assert "infos" not in [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    # Une base à jour n'est plus modifiée
+    storage.migrate(conn)
+    assert conn.execute("SELECT count(*) FROM devices").fetchone()[0] == 2
+    conn.close()
+
+
+def test_import_legacy_files(tmp_path):
+    create_legacy(str(tmp_path / "ipx800_10.0.0.1.db"), "10.0.0.1", [("lamp", "led0", "on")])
+    create_legacy(str(tmp_path / "ipx800_10.0.0.2.db"), "10.0.0.2", [("lamp", "led3,led4", "off")])
+    legacy = sqlite3.connect(str(tmp_path / "ipx800_10.0.0.2.db"))
+    storage.migrate(legacy, storage.LEGACY_VERSION)
+    now = time.time()
+    legacy.execute("INSERT INTO history (ts, tag, value) VALUES (?, 3, 1.0)", (now,))
+    legacy.execute("INSERT INTO history_minute (tag, ts, avg, min, max, count) VALUES (3, ?, 1, 1, 1, 2)", (int(now),))
+    legacy.commit()
+    legacy.close()
+
+    conn = sqlite3.connect(str(tmp_path / storage.DB_NAME))
+    storage.migrate(conn)
+    storage.import_legacy(conn, str(tmp_path))
+    storage.import_legacy(conn, str(tmp_path))
+
+    assert conn.execute('''
+        SELECT b.ip_address, d.device_name, d.led_mask, d.state
+        FROM devices d JOIN boards b ON b.id = d.board_id ORDER BY b.ip_address
+    ''').fetchall() == [("10.0.0.1", "lamp", 0b1, "on"), ("10.0.0.2", "lamp", 0b11000, "off")]
+    board = conn.execute("SELECT id FROM boards WHERE ip_address = '10.0.0.2'").fetchone()[0]
+    assert conn.execute("SELECT board_id, value FROM history").fetchall() == [(board, 1.0)]
+    assert conn.execute("SELECT board_id, count FROM history_minute").fetchall() == [(board, 2)]
+    assert conn.execute("SELECT count(*) FROM imported_files").fetchone()[0] == 2
+    conn.close()
+
+    # Les fichiers d'origine ne sont pas touchés
+    original = sqlite3.connect(str(tmp_path / "ipx800_10.0.0.1.db"))
+    assert original.execute("PRAGMA user_version").fetchone()[0] == 0
+    assert "select_leds" in columns(original, "devices")
+    original.close()